@@ -0,0 +1,174 @@
+"""Scaling benchmark for calendar parsing, recurrence expansion, free time and export.
+
+Example:
+    python benchmark.py --sizes 100 1000 10000 100000 1000000
+
+Every run is appended to benchmark_results.jsonl together with the git
+revision, and compared against the latest run of a different revision.
+"""
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+from icalendar import Calendar, Timezone
+import recurring_ical_events
+from intervals import events_to_intervals, events_by_date_from_intervals, calculate_free_time, calculate_free_time_vectorized
+from planner import create_ics
+
+
+TIMEZONES = ["Europe/Berlin", "America/New_York", "Asia/Tokyo"]
+
+
+def generate_calendar(occurrences, days=365, start=date(2025, 1, 1), recurring_share=0.6,
+                      all_day_share=0.05, multi_day_share=0.02, timezone_share=0.3, seed=0):
+    """Return (ics bytes, exact number of occurrences) of a synthetic calendar.
+
+    About recurring_share of the occurrences come from daily series with
+    EXDATEs and weekly series, the rest are single events. A share of the
+    events is all-day, spans several days or is pinned to a time zone.
+    """
+    rng = random.Random(seed)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//SchedulEase benchmark//EN", "CALSCALE:GREGORIAN"]
+    for tzid in TIMEZONES:
+        lines.append(Timezone.from_tzinfo(ZoneInfo(tzid)).to_ical().decode().strip())
+
+    def stamp(moment):
+        return moment.strftime("%Y%m%dT%H%M%S")
+
+    produced = 0
+    uid = 0
+    while produced < occurrences:
+        uid += 1
+        remaining = occurrences - produced
+        day = start + timedelta(days=rng.randrange(days))
+        begin = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(6 * 60, 20 * 60, 15))
+        lines += ["BEGIN:VEVENT", f"UID:event-{uid}@benchmark", "DTSTAMP:20250101T000000Z", f"SUMMARY:Event {uid}"]
+        kind = rng.random()
+
+        if kind < all_day_share:
+            lines += [f"DTSTART;VALUE=DATE:{day:%Y%m%d}", f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}"]
+            produced += 1
+        elif kind < all_day_share + multi_day_share:
+            lines += [f"DTSTART:{stamp(begin)}", f"DTEND:{stamp(begin + timedelta(days=rng.randint(1, 4)))}"]
+            produced += 1
+        else:
+            end = begin + timedelta(minutes=rng.choice([30, 45, 60, 90, 120]))
+            parameters = f";TZID={rng.choice(TIMEZONES)}" if rng.random() < timezone_share else ""
+            lines += [f"DTSTART{parameters}:{stamp(begin)}", f"DTEND{parameters}:{stamp(end)}"]
+
+            if rng.random() < recurring_share and remaining > 1:
+                if rng.random() < 0.5:
+                    # Daily series with a few skipped days
+                    count = min(remaining + 3, rng.randint(5, 60))
+                    skipped = sorted(rng.sample(range(1, count), min(3, count - 1)))
+                    lines.append(f"RRULE:FREQ=DAILY;COUNT={count}")
+                    lines += [f"EXDATE{parameters}:{stamp(begin + timedelta(days=offset))}" for offset in skipped]
+                    produced += count - len(skipped)
+                else:
+                    count = min(remaining, rng.randint(4, 52))
+                    lines.append(f"RRULE:FREQ=WEEKLY;COUNT={count}")
+                    produced += count
+            else:
+                produced += 1
+        lines.append("END:VEVENT")
+
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode(), produced
+
+
+def measure(function, repeat):
+    """Best wall time of repeat calls and the result of the last one."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_size(occurrences, days, repeat):
+    data, produced = generate_calendar(occurrences, days=days)
+    window_start = datetime(2025, 1, 1)
+    window_end = window_start + timedelta(days=days + 70)
+    last_day = (window_end - timedelta(days=1)).date()
+    timings = {}
+
+    timings["parse"], calendar = measure(lambda: Calendar.from_ical(data), repeat)
+    timings["expand"], events = measure(lambda: list(recurring_ical_events.of(calendar).between(window_start, window_end)), repeat)
+    timings["intervals"], intervals = measure(lambda: events_to_intervals(events), repeat)
+    timings["free_time"], free_time = measure(lambda: calculate_free_time(window_start.date(), last_day, intervals), repeat)
+    timings["free_time_vectorized"], free_time_vectorized = measure(
+        lambda: calculate_free_time_vectorized(window_start.date(), last_day, intervals, include_periods=False), repeat
+    )
+    if free_time["FreeTimeDays"] != free_time_vectorized["FreeTimeDays"]:
+        raise RuntimeError("calculate_free_time_vectorized disagrees with calculate_free_time")
+    schedule = events_by_date_from_intervals(intervals)
+    timings["export"], _ = measure(lambda: create_ics(schedule), repeat)
+
+    return {"occurrences": produced, "expanded": len(events), "bytes": len(data), "seconds": timings}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_results(path):
+    try:
+        with open(path) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(current, previous, threshold):
+    """Print stage timings next to the previous run and return the regressions."""
+    baseline = {result["occurrences"]: result["seconds"] for result in previous["results"]} if previous else {}
+    regressions = []
+    for result in current["results"]:
+        for stage, seconds in result["seconds"].items():
+            before = baseline.get(result["occurrences"], {}).get(stage)
+            note = ""
+            if before:
+                ratio = seconds / before
+                note = f"  {ratio:.2f}x vs {previous['revision']}"
+                if ratio > threshold:
+                    note += "  REGRESSION"
+                    regressions.append((result["occurrences"], stage, ratio))
+            print(f"{result['occurrences']:>9} {stage:<22} {seconds * 1000:>12.2f} ms{note}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time calendar parsing, expansion, free time and export on synthetic calendars.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="occurrences per calendar")
+    parser.add_argument("--days", type=int, default=365, help="days the events are spread over")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one counts")
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="file the runs are appended to")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    current = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "results": [run_size(size, args.days, args.repeat) for size in args.sizes],
+    }
+
+    previous = next((run for run in reversed(load_results(args.results)) if run["revision"] != current["revision"]), None)
+    regressions = compare(current, previous, args.threshold)
+
+    with open(args.results, "a") as file:
+        file.write(json.dumps(current) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
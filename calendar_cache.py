@@ -0,0 +1,327 @@
+from datetime import datetime, date, time, timedelta
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import hashlib
+import threading
+from icalendar import Calendar
+import recurring_ical_events
+from ics_reader import fallback_uid, read_calendar_window
+from instrumentation import span
+
+
+def to_naive_datetime(value):
+    """Bring date, naive and aware datetimes to one comparable wall-clock form."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    return value
+
+
+def occurrence_bounds(event):
+    start = event["DTSTART"].dt
+    if "DTEND" in event:
+        end = event["DTEND"].dt
+    elif "DURATION" in event:
+        end = start + event["DURATION"].dt
+    else:
+        end = start
+    return to_naive_datetime(start), to_naive_datetime(end)
+
+
+# Upper bound of the time between two occurrences for each FREQ
+FREQ_STEP = {
+    "SECONDLY": timedelta(seconds=1),
+    "MINUTELY": timedelta(minutes=1),
+    "HOURLY": timedelta(hours=1),
+    "DAILY": timedelta(days=1),
+    "WEEKLY": timedelta(weeks=1),
+    "MONTHLY": timedelta(days=31),
+    "YEARLY": timedelta(days=366),
+}
+
+# Wall-clock comparisons across time zones are off by less than a day
+SLACK = timedelta(days=1)
+
+
+def component_bounds(component):
+    """(first start, last end) a VEVENT can cover; None for an unbounded end."""
+    start, end = occurrence_bounds(component)
+    rrule = component.get("RRULE")
+    if rrule is None and "RDATE" not in component:
+        return start - SLACK, end + SLACK
+    if rrule is None or isinstance(rrule, list) or "RDATE" in component:
+        return start - SLACK, None
+
+    length = end - start
+    if "UNTIL" in rrule:
+        return start - SLACK, to_naive_datetime(rrule["UNTIL"][0]) + length + SLACK
+    step = FREQ_STEP.get(rrule.get("FREQ", [None])[0])
+    if "COUNT" in rrule and step is not None and not any(key.startswith("BY") for key in rrule):
+        return start - SLACK, start + step * rrule.get("INTERVAL", [1])[0] * rrule["COUNT"][0] + length + SLACK
+    return start - SLACK, None
+
+
+def split_series(calendar):
+    """Group the VEVENTs of calendar by UID with the bounds of each group.
+
+    A master and its RECURRENCE-ID overrides always stay together, since
+    recurrence expansion needs both.
+    """
+    groups = OrderedDict()
+    for component in calendar.walk("VEVENT"):
+        groups.setdefault(str(component.get("UID", id(component))), []).append(component)
+
+    series = []
+    for components in groups.values():
+        lower, upper = None, None
+        unbounded = False
+        for component in components:
+            component_lower, component_upper = component_bounds(component)
+            lower = component_lower if lower is None else min(lower, component_lower)
+            if component_upper is None:
+                unbounded = True
+            elif upper is None or component_upper > upper:
+                upper = component_upper
+        series.append((lower, None if unbounded else upper, components))
+    return series
+
+
+def add_missing_uids(calendar):
+    """Give every VEVENT without a UID its own, so occurrence_key tells such events apart."""
+    taken = {}
+    for component in calendar.walk("VEVENT"):
+        if "UID" not in component:
+            component.add("UID", fallback_uid(component.to_ical(), taken))
+    return calendar
+
+
+def occurrence_key(event):
+    recurrence_id = event.get("RECURRENCE-ID")
+    return str(event.get("UID", "")), to_naive_datetime(recurrence_id.dt if recurrence_id else event["DTSTART"].dt)
+
+
+class OccurrenceIndex:
+    """Expanded occurrences of one calendar, grouped by series.
+
+    Every UID keeps its occurrences in arrays sorted by start, and an
+    occurrence is identified by its RECURRENCE-ID, so expanding a window
+    twice never duplicates it. covered lists the disjoint [start, end)
+    windows already expanded; missing() tells which parts of a new window
+    still have to be expanded, and between() answers from the arrays with
+    bisection.
+    """
+
+    def __init__(self):
+        self.covered = []
+        self.series = {}
+
+    def missing(self, start, end):
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self.covered:
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def add(self, start, end, events):
+        for event in events:
+            uid, recurrence_id = occurrence_key(event)
+            series = self.series.get(uid)
+            if series is None:
+                series = self.series[uid] = {"starts": [], "ends": [], "events": [], "known": set(), "longest": timedelta(0)}
+            if recurrence_id in series["known"]:
+                continue
+            series["known"].add(recurrence_id)
+
+            event_start, event_end = occurrence_bounds(event)
+            # Windows usually grow forward, so appending is the common case
+            position = len(series["starts"])
+            if position and series["starts"][-1] > event_start:
+                position = bisect_right(series["starts"], event_start)
+            series["starts"].insert(position, event_start)
+            series["ends"].insert(position, event_end)
+            series["events"].insert(position, event)
+            series["longest"] = max(series["longest"], event_end - event_start)
+
+        # Merge the new window into the covered ones
+        covered = sorted(self.covered + [(start, end)])
+        self.covered = [covered[0]]
+        for covered_start, covered_end in covered[1:]:
+            if covered_start <= self.covered[-1][1]:
+                self.covered[-1] = (self.covered[-1][0], max(self.covered[-1][1], covered_end))
+            else:
+                self.covered.append((covered_start, covered_end))
+
+    def between(self, start, end):
+        found = []
+        for series in self.series.values():
+            starts = series["starts"]
+            # Only occurrences starting up to the longest duration before the window can overlap it
+            first = bisect_left(starts, start - series["longest"])
+            last = bisect_left(starts, end)
+            for position in range(first, last):
+                event_start = starts[position]
+                if series["ends"][position] > start or event_start >= start:
+                    found.append((event_start, series["events"][position]))
+        found.sort(key=lambda item: item[0])
+        return [event for _, event in found]
+
+
+class CalendarCache:
+    """Process-wide cache of parsed calendars and their expanded occurrences.
+
+    Entries are keyed by a SHA-256 of the file bytes. Every entry keeps the
+    parsed Calendar and an OccurrenceIndex of everything expanded so far;
+    a request only expands the parts of its window not covered yet. Entries
+    are evicted least-recently-used once max_entries or max_bytes (size of
+    the source files) is exceeded. All methods are thread safe, so one
+    instance can be shared by every Streamlit session in the process; each
+    entry has its own lock, so only requests for the same calendar wait for
+    each other.
+
+    Files larger than stream_threshold bytes are never parsed as a whole;
+    each missing window is read with ics_reader.read_calendar_window.
+    """
+
+    def __init__(self, max_entries=16, max_bytes=256 * 1024 * 1024, stream_threshold=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stream_threshold = stream_threshold
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "calendar_hits": 0,
+            "calendar_misses": 0,
+            "window_hits": 0,
+            "window_misses": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def fingerprint(file_content):
+        if isinstance(file_content, str):
+            file_content = file_content.encode()
+        return hashlib.sha256(file_content).hexdigest()
+
+    def _entry(self, file_content):
+        """The entry of file_content, parsed; the cache lock only guards the LRU bookkeeping."""
+        key = self.fingerprint(file_content)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["calendar_hits"] += 1
+            else:
+                self.stats["calendar_misses"] += 1
+                streamed = len(file_content) > self.stream_threshold
+                entry = {
+                    # Parsing and expanding one calendar never blocks the others
+                    "lock": threading.Lock(),
+                    "parsed": streamed,
+                    "calendar": None,
+                    "source": file_content if streamed else None,
+                    "size": len(file_content),
+                    "series": None,
+                    "index": OccurrenceIndex(),
+                }
+                self._entries[key] = entry
+                self._total_bytes += entry["size"]
+                self._evict()
+
+        if not entry["parsed"]:
+            with entry["lock"]:
+                if not entry["parsed"]:
+                    with span("parse_calendar", bytes=len(file_content), streamed=False):
+                        entry["calendar"] = add_missing_uids(Calendar.from_ical(file_content))
+                    entry["parsed"] = True
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry["size"]
+            self.stats["evictions"] += 1
+
+    def get_calendar(self, file_content):
+        entry = self._entry(file_content)
+        return entry["calendar"] or Calendar.from_ical(file_content)
+
+    @staticmethod
+    def _expand(entry, start, end):
+        with span("expand_recurrences", start=start, end=end) as record:
+            if entry["calendar"] is not None:
+                if entry["series"] is None:
+                    entry["series"] = split_series(entry["calendar"])
+
+                # Only series that can reach the window are expanded, so moving
+                # a date picker by a week does not walk the whole calendar
+                window = Calendar()
+                for name, value in entry["calendar"].property_items(recursive=False):
+                    if name not in ("BEGIN", "END"):
+                        window.add(name, value, encode=False)
+                for timezone in entry["calendar"].walk("VTIMEZONE"):
+                    window.add_component(timezone)
+                candidates = 0
+                for lower, upper, components in entry["series"]:
+                    if lower < end and (upper is None or upper > start):
+                        candidates += 1
+                        for component in components:
+                            window.add_component(component)
+                record["series"] = candidates
+                events = recurring_ical_events.of(window).between(start, end)
+            else:
+                window = add_missing_uids(read_calendar_window(entry["source"], start, end))
+                events = recurring_ical_events.of(window).between(start, end)
+            record["events"] = len(events)
+        return events
+
+    def get_occurrences(self, file_content, start_date, end_date):
+        """Return the events of file_content that overlap [start_date, end_date)."""
+        start = to_naive_datetime(start_date)
+        end = to_naive_datetime(end_date)
+
+        entry = self._entry(file_content)
+        with entry["lock"]:
+            index = entry["index"]
+
+            if start == end:
+                # A single instant is cheap to expand and would not extend the index
+                self._count("window_misses")
+                return list(self._expand(entry, start, end))
+
+            missing = index.missing(start, end)
+            if not missing:
+                self._count("window_hits")
+            else:
+                self._count("window_misses")
+                for missing_start, missing_end in missing:
+                    index.add(missing_start, missing_end, self._expand(entry, missing_start, missing_end))
+
+            return index.between(start, end)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._total_bytes)
+
+
+calendar_cache = CalendarCache()
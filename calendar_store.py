@@ -0,0 +1,387 @@
+from datetime import datetime, time
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import recurring_ical_events
+from icalendar.prop import vText
+from calendar_cache import occurrence_key
+from ics_reader import DTSTAMP_LINE, FOLDED_LINE, UID_LINE, fallback_uid, iter_components, read_calendar_window
+from instrumentation import span
+from intervals import (
+    DAY_START, DAY_END, MIN_GAP, MINUTES_PER_DAY, Interval, to_day, day_to_date,
+    event_to_interval, free_periods_by_day, contiguous_runs, free_time_from_periods,
+)
+
+
+DEFAULT_STORE_PATH = os.environ.get(
+    "SCHEDULEASE_CALENDAR_STORE",
+    os.path.join(os.path.expanduser("~"), ".cache", "schedulease", "calendars.sqlite3"),
+)
+
+SEQUENCE_LINE = re.compile(rb"^SEQUENCE(?:;[^:\r\n]*)?:\s*(\d+)", re.MULTILINE)
+LAST_MODIFIED_LINE = re.compile(rb"^LAST-MODIFIED(?:;[^:\r\n]*)?:([^\r\n]*)", re.MULTILINE)
+
+
+def split_calendar(file_content):
+    """Return (prelude, {uid: [VEVENT blocks]}) of the raw file without parsing it.
+
+    The prelude is the calendar header with all VTIMEZONE definitions. A
+    master event and its RECURRENCE-ID overrides share a UID and so end up
+    in the same series. A VEVENT without a UID gets one from fallback_uid,
+    written into its block, so it is a series and has occurrences of its own.
+    """
+    if isinstance(file_content, str):
+        file_content = file_content.encode()
+    if file_content.find(b"BEGIN:VCALENDAR") < 0:
+        raise ValueError("Not an iCalendar file: BEGIN:VCALENDAR is missing")
+
+    header = b"BEGIN:VCALENDAR\r\n"
+    timezones = []
+    series = OrderedDict()
+    taken = {}
+    for name, block in iter_components(file_content):
+        if name == b"VCALENDAR":
+            header = block
+        elif name == b"VTIMEZONE":
+            timezones.append(block)
+        elif name == b"VEVENT":
+            uid = UID_LINE.search(FOLDED_LINE.sub(b"", block))
+            if uid:
+                # Same text as str(event["UID"]) after parsing, see occurrence_key
+                uid = str(vText.from_ical(uid.group(1).strip().decode()))
+            else:
+                uid = fallback_uid(block, taken)
+                first_line = block.index(b"\n") + 1
+                block = block[:first_line] + f"UID:{uid}\r\n".encode() + block[first_line:]
+            series.setdefault(uid, []).append(block)
+
+    if not header.endswith(b"\n"):
+        header += b"\r\n"
+    return header + b"".join(timezones), series
+
+
+def series_version(blocks):
+    """(SEQUENCE, LAST-MODIFIED, digest) of one series; the first two are None when missing."""
+    unfolded = sorted(FOLDED_LINE.sub(b"", block) for block in blocks)
+    sequences = [int(match.group(1)) for match in map(SEQUENCE_LINE.search, unfolded) if match]
+    modified = [match.group(1).strip().decode() for match in map(LAST_MODIFIED_LINE.search, unfolded) if match]
+    digest = hashlib.sha256(b"".join(DTSTAMP_LINE.sub(b"", block) for block in unfolded)).hexdigest()
+    return max(sequences, default=None), max(modified, default=None), digest
+
+
+def is_unchanged(stored, version):
+    """A series with the same SEQUENCE and LAST-MODIFIED is trusted to be the same;
+    without LAST-MODIFIED the text of the series is compared."""
+    sequence, last_modified, digest = version
+    if last_modified is not None and (sequence, last_modified) == tuple(stored[:2]):
+        return True
+    return digest == stored[2]
+
+
+def occurrence_days(start, end):
+    """Day numbers touched by an occurrence from start to end (minutes since 1970)."""
+    return range(start // MINUTES_PER_DAY, max(start, end - 1) // MINUTES_PER_DAY + 1)
+
+
+def day_to_datetime(day):
+    return datetime.combine(day_to_date(day), time())
+
+
+class CalendarStore:
+    """Persistent store of calendar events and the free time computed from them.
+
+    Calendars are stored by name as their series,
+    i.e. the VEVENTs sharing a UID, together with the occurrences expanded
+    for the days asked for so far and the free time of every day for every
+    set of rules (day start, day end, minimum gap).
+
+    sync() compares a new upload of a calendar with the stored version by
+    UID, SEQUENCE and LAST-MODIFIED (or the text of the series when there is
+    no LAST-MODIFIED), re-expands only new and changed series and drops the
+    stored free time of only the days their old and new occurrences touch.
+    A daily re-upload of a large calendar then costs about the size of the
+    change. The name must be unique to whoever uploads the calendar and
+    stay the same across sessions (e.g. a user id and the file name);
+    sync_and_free_periods syncs and reads with no other sync of the same
+    name in between. At most max_calendars calendars are kept, the least
+    recently synced ones are dropped first. The SQLite file is opened on
+    first use and shared by all threads; each name also has its own lock,
+    so a sync and read of one calendar does not hold up the others between
+    its steps.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_calendars=256):
+        self.path = path
+        self.max_calendars = max_calendars
+        self._connection = None
+        self._lock = threading.RLock()
+        self._name_locks = {}
+        self.stats = {"syncs": 0, "unchanged_uploads": 0, "series_changed": 0, "days_invalidated": 0,
+                      "days_cached": 0, "days_computed": 0}
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS calendars ("
+                "name TEXT PRIMARY KEY, digest TEXT, prelude BLOB, prelude_digest TEXT, "
+                "first_day INTEGER, last_day INTEGER, longest INTEGER);"
+                "CREATE TABLE IF NOT EXISTS series ("
+                "calendar TEXT, uid TEXT, sequence INTEGER, last_modified TEXT, digest TEXT, ics BLOB, "
+                "PRIMARY KEY (calendar, uid));"
+                "CREATE TABLE IF NOT EXISTS occurrences ("
+                "calendar TEXT, uid TEXT, recurrence TEXT, start INTEGER, end INTEGER, summary TEXT, "
+                "PRIMARY KEY (calendar, uid, recurrence));"
+                "CREATE INDEX IF NOT EXISTS occurrences_start ON occurrences (calendar, start);"
+                "CREATE TABLE IF NOT EXISTS availability ("
+                "calendar TEXT, rules TEXT, day INTEGER, hours REAL, periods TEXT, "
+                "PRIMARY KEY (calendar, rules, day));"
+            )
+            columns = [column[1] for column in self._connection.execute("PRAGMA table_info(calendars)")]
+            if "synced_at" not in columns:
+                self._connection.execute("ALTER TABLE calendars ADD COLUMN synced_at REAL DEFAULT 0")
+        return self._connection
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.RLock())
+
+    @staticmethod
+    def _forget(connection, name):
+        for table, column in (("calendars", "name"), ("series", "calendar"), ("occurrences", "calendar"), ("availability", "calendar")):
+            connection.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+
+    @staticmethod
+    def _expand(prelude, blocks, first_day, last_day):
+        """Occurrence rows of the VEVENT blocks that overlap the days first_day to last_day."""
+        start = day_to_datetime(first_day)
+        end = day_to_datetime(last_day + 1)
+        with span("expand_recurrences", start=start, end=end) as record:
+            calendar = read_calendar_window(prelude + b"".join(blocks) + b"END:VCALENDAR\r\n", start, end)
+            events = recurring_ical_events.of(calendar).between(start, end)
+            record["events"] = len(events)
+
+        rows = []
+        for event in events:
+            uid, recurrence_id = occurrence_key(event)
+            interval = event_to_interval(event)
+            rows.append((uid, recurrence_id.isoformat(), interval.start, interval.end, interval.summary))
+        return rows
+
+    @staticmethod
+    def _insert_occurrences(connection, name, rows):
+        connection.executemany(
+            "INSERT OR IGNORE INTO occurrences (calendar, uid, recurrence, start, end, summary) VALUES (?, ?, ?, ?, ?, ?)",
+            [(name, *row) for row in rows],
+        )
+        longest = max((end - start for _, _, start, end, _ in rows), default=0)
+        connection.execute("UPDATE calendars SET longest = MAX(longest, ?) WHERE name = ?", (longest, name))
+
+    def sync(self, name, file_content):
+        """Bring the stored calendar name up to date with file_content and report what changed."""
+        if isinstance(file_content, str):
+            file_content = file_content.encode()
+        content_digest = hashlib.sha256(file_content).hexdigest()
+        report = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "invalidated_days": 0}
+
+        with self._name_lock(name), self._lock:
+            connection = self._connect()
+            self.stats["syncs"] += 1
+            row = connection.execute(
+                "SELECT digest, prelude_digest, first_day, last_day FROM calendars WHERE name = ?", (name,)
+            ).fetchone()
+            connection.execute("UPDATE calendars SET synced_at = ? WHERE name = ?", (datetime.now().timestamp(), name))
+            if row is not None and row[0] == content_digest:
+                self.stats["unchanged_uploads"] += 1
+                connection.commit()
+                return report
+
+            with span("sync_calendar", bytes=len(file_content)) as record:
+                prelude, series = split_calendar(file_content)
+                prelude_digest = hashlib.sha256(prelude).hexdigest()
+
+                if row is None or row[1] != prelude_digest:
+                    # New calendar, or its time zones changed: start over
+                    self._forget(connection, name)
+                    connection.execute(
+                        "INSERT INTO calendars (name, digest, prelude, prelude_digest, first_day, last_day, longest, synced_at) "
+                        "VALUES (?, ?, ?, ?, NULL, NULL, 0, ?)",
+                        (name, content_digest, prelude, prelude_digest, datetime.now().timestamp()),
+                    )
+                    for old_name, in connection.execute(
+                        "SELECT name FROM calendars ORDER BY synced_at DESC LIMIT -1 OFFSET ?", (self.max_calendars,)
+                    ).fetchall():
+                        self._forget(connection, old_name)
+                        self._name_locks.pop(old_name, None)
+                    first_day = last_day = None
+                    stored = {}
+                else:
+                    first_day, last_day = row[2], row[3]
+                    stored = {
+                        uid: version
+                        for uid, *version in connection.execute(
+                            "SELECT uid, sequence, last_modified, digest FROM series WHERE calendar = ?", (name,)
+                        )
+                    }
+
+                versions = {uid: series_version(blocks) for uid, blocks in series.items()}
+                changed = [uid for uid in series if uid not in stored or not is_unchanged(stored[uid], versions[uid])]
+                removed = [uid for uid in stored if uid not in series]
+
+                # Days touched by the occurrences that go away
+                affected_days = set()
+                for uid in [uid for uid in changed if uid in stored] + removed:
+                    for start, end in connection.execute(
+                        "SELECT start, end FROM occurrences WHERE calendar = ? AND uid = ?", (name, uid)
+                    ):
+                        affected_days.update(occurrence_days(start, end))
+                    connection.execute("DELETE FROM occurrences WHERE calendar = ? AND uid = ?", (name, uid))
+
+                connection.executemany("DELETE FROM series WHERE calendar = ? AND uid = ?", [(name, uid) for uid in removed])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO series (calendar, uid, sequence, last_modified, digest, ics) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(name, uid, *versions[uid], b"".join(series[uid])) for uid in changed],
+                )
+
+                # ... and by the new ones, for the days expanded so far
+                if changed and first_day is not None:
+                    rows = self._expand(prelude, [block for uid in changed for block in series[uid]], first_day, last_day)
+                    self._insert_occurrences(connection, name, rows)
+                    for _, _, start, end, _ in rows:
+                        affected_days.update(occurrence_days(start, end))
+
+                connection.executemany(
+                    "DELETE FROM availability WHERE calendar = ? AND day = ?", [(name, day) for day in affected_days]
+                )
+                connection.execute("UPDATE calendars SET digest = ? WHERE name = ?", (content_digest, name))
+                connection.commit()
+
+                report.update(
+                    added=sum(uid not in stored for uid in changed),
+                    changed=sum(uid in stored for uid in changed),
+                    removed=len(removed),
+                    unchanged=len(series) - len(changed),
+                    invalidated_days=len(affected_days),
+                )
+                record.update(report)
+                self.stats["series_changed"] += len(changed) + len(removed)
+                self.stats["days_invalidated"] += len(affected_days)
+        return report
+
+    def _cover(self, connection, name, first_day, last_day):
+        """Expand all series for the days first_day to last_day that are not expanded yet."""
+        row = connection.execute("SELECT prelude, first_day, last_day FROM calendars WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"Calendar {name!r} is not stored, sync it first")
+        prelude, covered_first, covered_last = row
+
+        if covered_first is None:
+            missing = [(first_day, last_day)]
+            new_window = (first_day, last_day)
+        else:
+            # The covered days stay one contiguous run
+            missing = []
+            if first_day < covered_first:
+                missing.append((first_day, covered_first - 1))
+            if last_day > covered_last:
+                missing.append((covered_last + 1, last_day))
+            new_window = (min(first_day, covered_first), max(last_day, covered_last))
+        if not missing:
+            return
+
+        blocks = [ics for ics, in connection.execute("SELECT ics FROM series WHERE calendar = ?", (name,))]
+        for missing_first, missing_last in missing:
+            self._insert_occurrences(connection, name, self._expand(prelude, blocks, missing_first, missing_last))
+        connection.execute("UPDATE calendars SET first_day = ?, last_day = ? WHERE name = ?", (*new_window, name))
+        connection.commit()
+
+    def busy_intervals(self, name, from_date, to_date):
+        """Sorted Interval list of the stored calendar name overlapping the days from_date to to_date."""
+        first_day, last_day = to_day(from_date), to_day(to_date)
+        with self._lock:
+            connection = self._connect()
+            self._cover(connection, name, first_day, last_day)
+            return self._busy_intervals(connection, name, first_day, last_day)
+
+    @staticmethod
+    def _busy_intervals(connection, name, first_day, last_day):
+        start = first_day * MINUTES_PER_DAY
+        end = (last_day + 1) * MINUTES_PER_DAY
+        longest, = connection.execute("SELECT longest FROM calendars WHERE name = ?", (name,)).fetchone()
+        rows = connection.execute(
+            "SELECT start, end, summary FROM occurrences WHERE calendar = ? AND start >= ? AND start < ? "
+            "AND (end > ? OR start >= ?) ORDER BY start, end",
+            (name, start - longest, end, start, start),
+        )
+        return [Interval(*row) for row in rows]
+
+    def free_periods(self, name, first_day, last_day, day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """Return [(day, [(start, end), ...])] of free minutes-of-day of the stored calendar name.
+
+        Days computed before with the same rules are read back; only the
+        others (new days, or days touched by a change since) are computed.
+        """
+        rules = json.dumps([day_start, day_end, min_gap])
+
+        with self._lock:
+            connection = self._connect()
+            days = {
+                day: [tuple(period) for period in json.loads(periods)]
+                for day, periods in connection.execute(
+                    "SELECT day, periods FROM availability WHERE calendar = ? AND rules = ? AND day BETWEEN ? AND ?",
+                    (name, rules, first_day, last_day),
+                )
+            }
+            missing = [day for day in range(first_day, last_day + 1) if day not in days]
+            self.stats["days_cached"] += len(days)
+            self.stats["days_computed"] += len(missing)
+
+            if missing:
+                self._cover(connection, name, missing[0], missing[-1])
+                rows = []
+                for run_first, run_last in contiguous_runs(missing):
+                    intervals = self._busy_intervals(connection, name, run_first, run_last)
+                    for day, periods in free_periods_by_day(run_first, run_last, intervals, day_start, day_end, min_gap):
+                        days[day] = periods
+                        hours = round(sum((end - start) / 60 for start, end in periods), 1)
+                        rows.append((name, rules, day, hours, json.dumps(periods)))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO availability (calendar, rules, day, hours, periods) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                connection.commit()
+
+        return [(day, days[day]) for day in range(first_day, last_day + 1)]
+
+    def sync_and_free_periods(self, name, file_content, first_day, last_day,
+                              day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """sync() then free_periods() with no other sync of name in between."""
+        with self._name_lock(name):
+            self.sync(name, file_content)
+            return self.free_periods(name, first_day, last_day, day_start, day_end, min_gap)
+
+    def free_time(self, name, from_date, to_date, day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """Same result as calculate_free_time for the stored calendar name."""
+        first_day, last_day = to_day(from_date), to_day(to_date)
+        periods = self.free_periods(name, first_day, last_day, day_start, day_end, min_gap)
+        return free_time_from_periods(first_day, last_day, dict(periods))
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            for table in ("calendars", "series", "occurrences", "availability"):
+                connection.execute(f"DELETE FROM {table}")
+            connection.commit()
+
+    def info(self):
+        with self._lock:
+            count, = self._connect().execute("SELECT COUNT(*) FROM calendars").fetchone()
+            return dict(self.stats, calendars=count)
+
+
+calendar_store = CalendarStore()
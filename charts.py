@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import io
+import json
+import threading
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from instrumentation import span
+from intervals import DATE_FORMAT
+
+
+GRANULARITIES = ["day", "week", "month", "heatmap"]
+
+# Longest ranges (in days) still readable with one bar per day or per week
+MAX_DAILY_BARS = 45
+MAX_WEEKLY_BARS = 183
+
+
+def pick_granularity(day_count):
+    if day_count <= MAX_DAILY_BARS:
+        return "day"
+    if day_count <= MAX_WEEKLY_BARS:
+        return "week"
+    return "month"
+
+
+def free_hours_series(free_time_days, from_date, to_date):
+    """Free hours of every day from from_date to to_date as a pandas Series, 0 for busy days."""
+    days = pd.date_range(from_date, to_date, freq="D")
+    hours = pd.Series(
+        {datetime.strptime(date_str, DATE_FORMAT): hours for date_str, hours in free_time_days},
+        dtype="float64",
+    )
+    return hours.reindex(days, fill_value=0.0)
+
+
+def aggregate_free_hours(hours, granularity):
+    """Sum daily free hours into (label, hours) rows per day, week (starting Monday) or month."""
+    if granularity == "day":
+        return [(day.strftime(DATE_FORMAT), value) for day, value in hours.items()]
+    if granularity == "week":
+        # Weeks are labelled by their Monday, the range may start mid-week
+        totals = hours.groupby(hours.index - pd.to_timedelta(hours.index.weekday, unit="D")).sum()
+        return [(week.strftime(DATE_FORMAT), value) for week, value in totals.items()]
+    if granularity == "month":
+        totals = hours.groupby(hours.index.to_period("M")).sum()
+        return [(month.strftime("%b %Y"), value) for month, value in totals.items()]
+    raise ValueError(f"Unknown granularity {granularity!r}, expected one of {GRANULARITIES}")
+
+
+def bar_figure(rows, granularity):
+    labels = [label for label, _ in rows]
+    values = [value for _, value in rows]
+    fig, ax = plt.subplots(figsize=(8, max(3, min(0.25 * len(rows), 12))))
+    ax.barh(labels, values, color="skyblue")
+    ax.invert_yaxis()
+    ax.set_xlabel("Free Hours")
+    ax.set_ylabel({"day": "Date", "week": "Week starting", "month": "Month"}[granularity])
+    ax.set_title(f"Free Hours by {'Date' if granularity == 'day' else granularity.capitalize()}")
+    ax.grid(axis="x", linestyle="--", alpha=0.7)
+    fig.tight_layout()
+    return fig
+
+
+def heatmap_figure(hours):
+    """Calendar heatmap: one column per week, one row per weekday."""
+    first_monday = hours.index[0] - pd.Timedelta(days=hours.index[0].weekday())
+    offsets = (hours.index - first_monday).days.to_numpy()
+    weeks = offsets[-1] // 7 + 1
+
+    grid = np.full((7, weeks), np.nan)
+    grid[offsets % 7, offsets // 7] = hours.to_numpy()
+
+    fig, ax = plt.subplots(figsize=(min(2 + 0.22 * weeks, 16), 3))
+    image = ax.imshow(np.ma.masked_invalid(grid), aspect="auto", cmap="Blues", interpolation="nearest")
+    ax.set_yticks(range(7))
+    ax.set_yticklabels(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+
+    # A tick at the week holding the first of every month, plus the start
+    # of the range unless a month begins right after it
+    month_starts = pd.date_range(hours.index[0], hours.index[-1], freq="MS")
+    ticks = [(day - first_monday).days // 7 for day in month_starts]
+    labels = [day.strftime("%b %Y" if day.month == 1 or index == 0 else "%b") for index, day in enumerate(month_starts)]
+    if not ticks or ticks[0] > 2:
+        ticks.insert(0, 0)
+        labels.insert(0, hours.index[0].strftime("%b %Y"))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels)
+    ax.set_title("Free Hours by Day")
+    fig.colorbar(image, ax=ax, label="Free Hours")
+    fig.tight_layout()
+    return fig
+
+
+class ChartCache:
+    """Rendered availability charts as PNG bytes, keyed by a hash of the data shown.
+
+    Rendering a long range with matplotlib takes far longer than showing an
+    image, and Streamlit reruns the script on every interaction. At most
+    max_entries charts are kept, least recently used first out.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._charts = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(free_time_days, from_date, to_date, granularity):
+        payload = json.dumps([free_time_days, str(from_date), str(to_date), granularity])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def render(self, free_time_days, from_date, to_date, granularity=None):
+        """Return (PNG bytes, granularity) of the free time chart; granularity None picks one by range size."""
+        hours = free_hours_series(free_time_days, from_date, to_date)
+        granularity = granularity or pick_granularity(len(hours))
+        if hours.empty:
+            # Nothing to lay out as a calendar
+            granularity = "day"
+        key = self.make_key(free_time_days, from_date, to_date, granularity)
+
+        with self._lock:
+            png = self._charts.get(key)
+            if png is not None:
+                self._charts.move_to_end(key)
+                self.stats["hits"] += 1
+                return png, granularity
+            self.stats["misses"] += 1
+
+        with span("render_chart", granularity=granularity, days=len(hours)):
+            if granularity == "heatmap":
+                fig = heatmap_figure(hours)
+            else:
+                fig = bar_figure(aggregate_free_hours(hours, granularity), granularity)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", dpi=100)
+            plt.close(fig)
+            png = buffer.getvalue()
+
+        with self._lock:
+            self._charts[key] = png
+            while len(self._charts) > self.max_entries:
+                self._charts.popitem(last=False)
+        return png, granularity
+
+
+chart_cache = ChartCache()
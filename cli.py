@@ -0,0 +1,162 @@
+"""Availability reports for many .ics files without the Streamlit app.
+
+Example:
+    python cli.py calendars/ --from 2025-01-01 --to 2025-03-31 --format csv --output report.csv
+"""
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import recurring_ical_events
+from ics_reader import read_calendar_window
+from intervals import DAY_START, DAY_END, MIN_GAP, time_to_minutes, events_to_intervals, calculate_free_time_vectorized
+
+
+FIELDS = ["calendar", "date", "free_hours", "free_periods"]
+
+
+def find_calendars(patterns):
+    """Expand directories (all .ics files inside, recursively) and glob patterns into paths."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(glob.glob(os.path.join(pattern, "**", "*.ics"), recursive=True))
+        else:
+            paths.extend(glob.glob(pattern, recursive=True))
+    return sorted(set(paths))
+
+
+def availability_rows(path, from_date, to_date, day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+    """One row per day from from_date to to_date (inclusive) for the calendar at path."""
+    window_start = datetime.combine(from_date, datetime.min.time())
+    window_end = window_start + timedelta(days=(to_date - from_date).days + 1)
+
+    # Read only the events that can fall into the window; nothing is cached
+    # because every file is visited once
+    calendar = read_calendar_window(path, window_start, window_end)
+    intervals = events_to_intervals(recurring_ical_events.of(calendar).between(window_start, window_end))
+    available_hours = calculate_free_time_vectorized(from_date, to_date, intervals, day_start, day_end, min_gap)
+
+    free_hours = dict(available_hours["FreeTimeDays"])
+    return [
+        {
+            "calendar": path,
+            "date": date_str,
+            "free_hours": free_hours.get(date_str, 0),
+            "free_periods": " ".join(periods),
+        }
+        for date_str, periods in available_hours["FreeTime"].items()
+    ]
+
+
+def process_calendar(arguments):
+    path = arguments[0]
+    try:
+        return path, availability_rows(*arguments), None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+
+class ReportWriter:
+    """Write rows as JSON Lines, CSV or Parquet, one chunk at a time.
+
+    Parquet has no append mode, so every chunk becomes its own numbered file
+    next to the output path (report-00000.parquet, report-00001.parquet, ...).
+    """
+
+    def __init__(self, output, output_format):
+        self.output = output
+        self.output_format = output_format
+        self.chunks = 0
+        self.file = None
+        if output_format in ("jsonl", "csv"):
+            self.file = sys.stdout if output == "-" else open(output, "w", newline="")
+            if output_format == "csv":
+                self.csv_writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+                self.csv_writer.writeheader()
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.output_format == "jsonl":
+            self.file.writelines(json.dumps(row) + "\n" for row in rows)
+        elif self.output_format == "csv":
+            self.csv_writer.writerows(rows)
+        else:
+            import pandas as pd
+
+            base, extension = os.path.splitext(self.output)
+            pd.DataFrame(rows, columns=FIELDS).to_parquet(f"{base}-{self.chunks:05d}{extension or '.parquet'}", index=False)
+        self.chunks += 1
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None and self.file is not sys.stdout:
+            self.file.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write free time of many .ics calendars as JSON Lines, CSV or Parquet.")
+    parser.add_argument("calendars", nargs="+", help="directories, files or glob patterns of .ics files")
+    parser.add_argument("--from", dest="from_date", required=True, type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(), help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="to_date", required=True, type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(), help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--format", dest="output_format", choices=["jsonl", "csv", "parquet"], default="jsonl")
+    parser.add_argument("--output", default="-", help="output file, '-' for stdout (not for parquet)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="calendars per written chunk")
+    parser.add_argument("--day-start", default="00.00", help="start of the day window, hh.mm")
+    parser.add_argument("--day-end", default="23.59", help="end of the day window, hh.mm")
+    parser.add_argument("--min-gap", type=int, default=MIN_GAP, help="shortest reported free period in minutes")
+    args = parser.parse_args(argv)
+
+    if args.from_date > args.to_date:
+        parser.error("--from must be earlier than or equal to --to")
+    if args.output_format == "parquet" and args.output == "-":
+        parser.error("--output is required for parquet")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = find_calendars(args.calendars)
+    if not paths:
+        print("No .ics files found.", file=sys.stderr)
+        return 1
+
+    jobs = [
+        (path, args.from_date, args.to_date, time_to_minutes(args.day_start), time_to_minutes(args.day_end), args.min_gap)
+        for path in paths
+    ]
+    writer = ReportWriter(args.output, args.output_format)
+    failures = 0
+    # Hand calendars to workers in small batches, but keep every core busy
+    batch = max(1, min(16, len(jobs) // (4 * args.workers)))
+    try:
+        with Pool(args.workers) as pool:
+            rows = []
+            calendars_in_chunk = 0
+            for path, calendar_rows, error in pool.imap(process_calendar, jobs, chunksize=batch):
+                if error is not None:
+                    failures += 1
+                    print(f"{path}: {error}", file=sys.stderr)
+                rows.extend(calendar_rows)
+                calendars_in_chunk += 1
+                if calendars_in_chunk >= args.chunk_size:
+                    writer.write(rows)
+                    rows = []
+                    calendars_in_chunk = 0
+            writer.write(rows)
+    finally:
+        writer.close()
+
+    print(f"Processed {len(paths)} calendars, {failures} failed.", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+import hashlib
+import threading
+from instrumentation import span
+from intervals import DAY_START, DAY_END, MIN_GAP, to_day, contiguous_runs, free_time_from_periods
+
+
+def team_fingerprint(fingerprints, quorum):
+    """One fingerprint for the free time of several calendars; their order does not matter."""
+    return hashlib.sha256(" ".join(sorted(fingerprints) + [str(quorum)]).encode()).hexdigest()
+
+
+class FreeTimeCache:
+    """Process-wide LRU cache of the free periods of single days.
+
+    A day is keyed by the fingerprint of its calendar (or team of calendars),
+    its day number and the rules (day start, day end, minimum gap), so a
+    changed range only computes the new days and the analyzer and the
+    planner share what either of them computed. At most max_days days are
+    kept; the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_days=100_000):
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"day_hits": 0, "day_misses": 0, "evictions": 0}
+
+    def free_periods(self, fingerprint, first_day, last_day, compute,
+                     day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """Return {day: [(start, end), ...]} for the days first_day to last_day.
+
+        compute(first, last) is called for every run of consecutive days not
+        in the cache and must return (day, periods) pairs for that run, like
+        free_periods_by_day.
+        """
+        rules = (day_start, day_end, min_gap)
+        periods_by_day = {}
+        missing = []
+        with self._lock:
+            for day in range(first_day, last_day + 1):
+                key = (fingerprint, rules, day)
+                periods = self._days.get(key)
+                if periods is None:
+                    missing.append(day)
+                else:
+                    self._days.move_to_end(key)
+                    periods_by_day[day] = periods
+            self.stats["day_hits"] += len(periods_by_day)
+            self.stats["day_misses"] += len(missing)
+
+        if missing:
+            # Computed outside the lock, other sessions keep reading meanwhile
+            with span("compute_free_days", days=len(missing)):
+                computed = [pair for run_first, run_last in contiguous_runs(missing) for pair in compute(run_first, run_last)]
+
+            with self._lock:
+                for day, periods in computed:
+                    periods = tuple(periods)
+                    periods_by_day[day] = periods
+                    self._days[(fingerprint, rules, day)] = periods
+                    self._days.move_to_end((fingerprint, rules, day))
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+                    self.stats["evictions"] += 1
+
+        return periods_by_day
+
+    def free_time(self, fingerprint, from_date, to_date, compute,
+                  day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """Same result as calculate_free_time, answered day by day from the cache."""
+        first_day, last_day = to_day(from_date), to_day(to_date)
+        periods_by_day = self.free_periods(fingerprint, first_day, last_day, compute, day_start, day_end, min_gap)
+        return free_time_from_periods(first_day, last_day, periods_by_day)
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, days=len(self._days))
+
+
+free_time_cache = FreeTimeCache()
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+import hashlib
+import mmap
+import re
+from icalendar import Calendar
+
+
+# A day of slack on each side covers any time zone shift, since only the
+# date part of DTSTART/DTEND/UNTIL is looked at before full parsing
+SLACK = timedelta(days=1)
+
+FOLDED_LINE = re.compile(rb"\r?\n[ \t]")
+PROPERTY_DATE = {
+    name: re.compile(rb"^" + name + rb"(?:;[^:\r\n]*)?:(\d{8})", re.MULTILINE)
+    for name in (b"DTSTART", b"DTEND", b"RECURRENCE-ID")
+}
+UID_LINE = re.compile(rb"^UID(?:;[^:\r\n]*)?:([^\r\n]*)", re.MULTILINE)
+RRULE_LINE = re.compile(rb"^RRULE[;:]([^\r\n]*)", re.MULTILINE)
+DURATION_LINE = re.compile(rb"^DURATION[;:]", re.MULTILINE)
+RDATE_LINE = re.compile(rb"^RDATE[;:]", re.MULTILINE)
+# Exporters stamp every event with the export time, which says nothing about the event
+DTSTAMP_LINE = re.compile(rb"^DTSTAMP[;:][^\r\n]*\r?\n?", re.MULTILINE)
+
+# Upper bound of the time between two occurrences for each FREQ
+FREQ_STEP = {
+    b"SECONDLY": timedelta(seconds=1),
+    b"MINUTELY": timedelta(minutes=1),
+    b"HOURLY": timedelta(hours=1),
+    b"DAILY": timedelta(days=1),
+    b"WEEKLY": timedelta(weeks=1),
+    b"MONTHLY": timedelta(days=31),
+    b"YEARLY": timedelta(days=366),
+}
+
+
+def to_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def fallback_uid(block, taken):
+    """UID for a VEVENT without one, from a digest of its text without DTSTAMP.
+
+    taken counts the UIDs handed out for one calendar, so identical events
+    get numbered UIDs and still count as separate events.
+    """
+    digest = hashlib.sha256(DTSTAMP_LINE.sub(b"", FOLDED_LINE.sub(b"", block))).hexdigest()
+    uid = f"no-uid-{digest}"
+    taken[uid] = taken.get(uid, 0) + 1
+    return uid if taken[uid] == 1 else f"{uid}-{taken[uid]}"
+
+
+def open_source(source):
+    """Return a bytes-like view of source: a path is memory-mapped, bytes are used as they are."""
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return source, None
+    file = open(source, "rb")
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), file
+    except ValueError:
+        # Empty files cannot be memory-mapped
+        return b"", file
+
+
+def iter_components(data):
+    """Yield (name, bytes) for every top-level component, reading one block at a time.
+
+    The calendar header (everything before the first component) is yielded
+    with the name b"VCALENDAR".
+    """
+    position = data.find(b"\nBEGIN:")
+    if position < 0:
+        return
+    yield b"VCALENDAR", bytes(data[:position + 1])
+
+    while position >= 0:
+        name_start = position + len(b"\nBEGIN:")
+        name_end = data.find(b"\n", name_start)
+        if name_end < 0:
+            return
+        name = bytes(data[name_start:name_end]).strip()
+        if name == b"VCALENDAR":
+            position = data.find(b"\nBEGIN:", name_end)
+            continue
+
+        end_marker = b"\nEND:" + name
+        block_end = data.find(end_marker, name_end)
+        if block_end < 0:
+            return
+        block_end = data.find(b"\n", block_end + len(end_marker))
+        block_end = len(data) if block_end < 0 else block_end + 1
+
+        yield name, bytes(data[position + 1:block_end])
+        position = data.find(b"\nBEGIN:", block_end - 1)
+
+
+def property_date(block, name):
+    match = PROPERTY_DATE[name].search(block)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1).decode(), "%Y%m%d").date()
+
+
+def recurrence_end(rrule, start):
+    """Latest date a recurrence can start on, or None when it is unbounded or unknown."""
+    parts = dict(part.split(b"=", 1) for part in rrule.strip().split(b";") if b"=" in part)
+    if b"UNTIL" in parts:
+        return datetime.strptime(parts[b"UNTIL"][:8].decode(), "%Y%m%d").date()
+    if b"COUNT" in parts and not any(key.startswith(b"BY") for key in parts):
+        step = FREQ_STEP.get(parts.get(b"FREQ"))
+        if step is not None:
+            interval = int(parts.get(b"INTERVAL", b"1"))
+            return start + step * interval * int(parts[b"COUNT"])
+    return None
+
+
+def may_intersect(block, window_start, window_end):
+    """Cheap check on the raw VEVENT text whether it can have an occurrence in the window."""
+    start = property_date(block, b"DTSTART")
+    if start is None or RDATE_LINE.search(block):
+        return True
+    if start > window_end + SLACK:
+        return False
+
+    end = property_date(block, b"DTEND")
+    if end is not None:
+        length = end - start
+    elif DURATION_LINE.search(block):
+        # Durations are rare and usually short; a month of room is enough
+        length = timedelta(days=31)
+    else:
+        length = timedelta()
+
+    rrule = RRULE_LINE.search(block)
+    last_start = recurrence_end(rrule.group(1), start) if rrule is not None else start
+    if last_start is None:
+        return True
+    return last_start + length + SLACK >= window_start
+
+
+def read_calendar_window(source, start_date, end_date):
+    """Parse only the events of source that can intersect [start_date, end_date).
+
+    source is a path (read through mmap) or the file bytes. VEVENT blocks are
+    scanned one at a time and filtered on their raw DTSTART/DTEND/RRULE text;
+    only candidates, their RECURRENCE-ID overrides and the VTIMEZONE
+    definitions are handed to Calendar.from_ical, so memory stays
+    proportional to the events in the window instead of the file size.
+    """
+    window_start = to_date(start_date)
+    window_end = to_date(end_date)
+
+    data, file = open_source(source)
+    try:
+        if data.find(b"BEGIN:VCALENDAR") < 0:
+            raise ValueError("Not an iCalendar file: BEGIN:VCALENDAR is missing")
+
+        header = b"BEGIN:VCALENDAR\r\n"
+        timezones = []
+        candidates = []
+        candidate_uids = set()
+        overrides = []
+
+        for name, block in iter_components(data):
+            if name == b"VCALENDAR":
+                header = block
+            elif name == b"VTIMEZONE":
+                timezones.append(block)
+            elif name == b"VEVENT":
+                unfolded = FOLDED_LINE.sub(b"", block)
+                uid = UID_LINE.search(unfolded)
+                uid = uid.group(1).strip() if uid else None
+                if PROPERTY_DATE[b"RECURRENCE-ID"].search(unfolded):
+                    # Decided once all masters are known
+                    overrides.append((uid, may_intersect(unfolded, window_start, window_end), block))
+                elif may_intersect(unfolded, window_start, window_end):
+                    candidates.append(block)
+                    candidate_uids.add(uid)
+
+        # An override must travel with its master even when it moved out of
+        # the window, otherwise the master would still produce that instance
+        for uid, intersects, block in overrides:
+            if intersects or uid in candidate_uids:
+                candidates.append(block)
+    finally:
+        if file is not None:
+            if isinstance(data, mmap.mmap):
+                data.close()
+            file.close()
+
+    if not header.endswith(b"\n"):
+        header += b"\r\n"
+    return Calendar.from_ical(header + b"".join(timezones) + b"".join(candidates) + b"END:VCALENDAR\r\n")
@@ -0,0 +1,114 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger("schedulease.timing")
+
+# tracemalloc gives exact peak memory per stage but slows Python code down,
+# so it is only switched on when asked for
+TRACK_MEMORY = os.environ.get("SCHEDULEASE_TRACK_MEMORY") == "1"
+
+# Spans kept per thread for collected_spans; a thread that never starts a
+# new run (e.g. the service's event loop) keeps only the latest ones
+MAX_SPANS = 1000
+
+_local = threading.local()
+
+
+def setup_logging(level=None):
+    """Emit one JSON object per finished span on stderr, once per process."""
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level or os.environ.get("SCHEDULEASE_LOG_LEVEL", "INFO"))
+    logger.propagate = False
+
+
+def start_run(name="run"):
+    """Forget the spans of the previous run of this thread (one Streamlit rerun)."""
+    _local.run = {"name": name, "id": f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}"}
+    _local.spans = deque(maxlen=MAX_SPANS)
+    _local.stack = []
+
+
+def collected_spans():
+    return list(getattr(_local, "spans", []))
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a stage. The yielded dict can be filled with counts, e.g. record["events"] = 120.
+
+    Wall time, the process max RSS and, with SCHEDULEASE_TRACK_MEMORY=1,
+    the peak Python memory of the stage are added when it ends.
+    """
+    if not hasattr(_local, "stack"):
+        start_run()
+    record = {"span": name, **attributes}
+    frame = {"peak": 0}
+
+    if TRACK_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    _local.stack.append(frame)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 6)
+        _local.stack.pop()
+        if resource is not None:
+            record["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        if TRACK_MEMORY:
+            # A nested span resets the peak, so it reports its own peak upwards
+            peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+            record["peak_memory_kb"] = round((peak - memory_start) / 1024, 1)
+            if _local.stack:
+                _local.stack[-1]["peak"] = max(_local.stack[-1]["peak"], peak)
+
+        record["depth"] = len(_local.stack)
+        record["run"] = _local.run["id"]
+        _local.spans.append(record)
+        logger.info(json.dumps(record, default=str))
+
+
+def record_span(name, seconds, **attributes):
+    """Log a stage that was timed elsewhere (e.g. in a coroutine) as a finished span of this thread."""
+    if not hasattr(_local, "stack"):
+        start_run()
+    record = {"span": name, **attributes, "seconds": round(seconds, 6), "depth": len(_local.stack), "run": _local.run["id"]}
+    _local.spans.append(record)
+    logger.info(json.dumps(record, default=str))
+    return record
+
+
+def timed(name=None):
+    """Decorator form of span."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
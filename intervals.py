@@ -0,0 +1,291 @@
+from datetime import datetime, date
+from collections import OrderedDict
+import numpy as np
+from instrumentation import timed
+
+
+DATE_FORMAT = "%d.%m.%Y"
+MINUTES_PER_DAY = 24 * 60
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Rules used by calculate_free_time: the whole day is available and gaps
+# shorter than half an hour are not worth reporting
+DAY_START = 0
+DAY_END = 23 * 60 + 59
+MIN_GAP = 30
+
+
+class Interval:
+    """A busy period in minutes since 1970-01-01 (wall-clock time)."""
+
+    __slots__ = ("start", "end", "summary")
+
+    def __init__(self, start, end, summary=""):
+        self.start = start
+        self.end = end
+        self.summary = summary
+
+    def __repr__(self):
+        return f"Interval({format_minutes(self.start)}, {format_minutes(self.end)}, {self.summary!r})"
+
+
+def time_to_minutes(time_str):
+    hours, minutes = time_str.split('.')
+    return int(hours) * 60 + int(minutes)
+
+
+def minutes_to_time(minutes):
+    return f"{minutes // 60:02d}.{minutes % 60:02d}"
+
+
+def to_day(value):
+    """Return the day number (days since 1970-01-01) of a date, datetime or date string."""
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        value = str(value)
+        value = datetime.strptime(value, "%Y-%m-%d" if "-" in value else DATE_FORMAT).date()
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def day_to_date(day):
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def day_to_str(day):
+    return day_to_date(day).strftime(DATE_FORMAT)
+
+
+def to_minutes(value):
+    """Minutes since 1970-01-01 of a date or datetime; time zones keep their own wall clock."""
+    if isinstance(value, datetime):
+        return (value.toordinal() - EPOCH_ORDINAL) * MINUTES_PER_DAY + value.hour * 60 + value.minute
+    return (value.toordinal() - EPOCH_ORDINAL) * MINUTES_PER_DAY
+
+
+def format_minutes(minutes):
+    day, minute_of_day = divmod(minutes, MINUTES_PER_DAY)
+    return f"{day_to_str(day)} {minutes_to_time(minute_of_day)}"
+
+
+def event_to_interval(event):
+    event_start = event["DTSTART"].dt
+    start = to_minutes(event_start)
+
+    if not isinstance(event_start, datetime):
+        # All-day events are listed but do not block any time
+        end = start
+    elif "DTEND" in event:
+        end = to_minutes(event["DTEND"].dt)
+    elif "DURATION" in event:
+        end = to_minutes(event_start + event["DURATION"].dt)
+    else:
+        end = start + 60  # Default duration of 1 hour
+
+    return Interval(start, max(start, end), str(event.get("SUMMARY", "")))
+
+
+def events_to_intervals(events):
+    intervals = [event_to_interval(event) for event in events]
+    intervals.sort(key=lambda interval: (interval.start, interval.end))
+    return intervals
+
+
+def intervals_from_events_by_date(events_by_date):
+    """Read the {"dd.mm.yyyy": ['hh.mm-hh.mm summary']} shape back into intervals."""
+    intervals = []
+    for date_str, event_list in events_by_date.items():
+        day_start = to_day(date_str) * MINUTES_PER_DAY
+        for event in event_list:
+            time_range, _, summary = event.partition(' ')
+            start, end = time_range.split('-')
+            start = day_start + time_to_minutes(start)
+            end = day_start + time_to_minutes(end)
+            if end < start:
+                # Rendered end time belongs to the next day
+                end += MINUTES_PER_DAY
+            intervals.append(Interval(start, end, summary))
+    intervals.sort(key=lambda interval: (interval.start, interval.end))
+    return intervals
+
+
+def merge_intervals(intervals):
+    """Merge sorted intervals into disjoint (start, end) pairs."""
+    merged = []
+    for interval in intervals:
+        if merged and interval.start <= merged[-1][1]:
+            if interval.end > merged[-1][1]:
+                merged[-1][1] = interval.end
+        else:
+            merged.append([interval.start, interval.end])
+    return merged
+
+
+def free_periods_by_day(first_day, last_day, intervals,
+                        day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+    """Yield (day, [(start, end), ...]) with free minutes-of-day for every day in range.
+
+    intervals must be sorted by start. One pass over the merged busy periods,
+    so the cost is linear in days plus events.
+    """
+    busy = merge_intervals(intervals)
+    index = 0
+
+    for day in range(first_day, last_day + 1):
+        window_start = day * MINUTES_PER_DAY + day_start
+        window_end = day * MINUTES_PER_DAY + day_end
+
+        # Skip busy periods that end before this day's window
+        while index < len(busy) and busy[index][1] <= window_start:
+            index += 1
+
+        periods = []
+        current_start = window_start
+        position = index
+        while position < len(busy) and busy[position][0] < window_end:
+            busy_start, busy_end = busy[position]
+            if busy_start - current_start > min_gap:
+                periods.append((current_start - day * MINUTES_PER_DAY, busy_start - day * MINUTES_PER_DAY))
+            current_start = max(current_start, busy_end)
+            position += 1
+        if window_end - current_start > min_gap:
+            periods.append((current_start - day * MINUTES_PER_DAY, day_end))
+
+        yield day, periods
+
+
+def contiguous_runs(days):
+    """Split sorted day numbers into (first, last) runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + 1:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def free_time_from_periods(first_day, last_day, periods_by_day):
+    """Build the result of calculate_free_time from {day: [(start, end), ...]} free minutes-of-day."""
+    FreeTime = {}
+    TotalFreeTime = 0
+    FreeTimeDays = []
+
+    for day in range(first_day, last_day + 1):
+        periods = periods_by_day[day]
+        date_str = day_to_str(day)
+        FreeTime[date_str] = [f"{minutes_to_time(start)}-{minutes_to_time(end)}" for start, end in periods]
+        day_free_hours = round(sum((end - start) / 60 for start, end in periods), 1)
+
+        if day_free_hours > 0:
+            FreeTimeDays.append((date_str, day_free_hours))
+            TotalFreeTime += day_free_hours
+
+    return {
+        "FreeTime": FreeTime,
+        "TotalFreeTime": TotalFreeTime,
+        "FreeTimeDays": FreeTimeDays
+    }
+
+
+@timed("calculate_free_time")
+def calculate_free_time(from_date, to_date, events_by_date,
+                        day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+    # events_by_date is either a list of Interval (see get_busy_intervals)
+    # or the formatted dict returned by get_events_between_dates
+    if isinstance(events_by_date, dict):
+        intervals = intervals_from_events_by_date(events_by_date)
+    else:
+        intervals = events_by_date
+
+    first_day, last_day = to_day(from_date), to_day(to_date)
+    periods_by_day = dict(free_periods_by_day(first_day, last_day, intervals, day_start, day_end, min_gap))
+
+    # Strings are produced only here, for presentation
+    return free_time_from_periods(first_day, last_day, periods_by_day)
+
+
+def events_by_date_from_intervals(intervals):
+    """Render intervals as the {"dd.mm.yyyy": ['hh.mm-hh.mm summary']} presentation shape."""
+    events_by_date = OrderedDict()
+    for interval in intervals:
+        day, start = divmod(interval.start, MINUTES_PER_DAY)
+        end = interval.end % MINUTES_PER_DAY
+        events_by_date.setdefault(day_to_str(day), []).append(
+            f"{minutes_to_time(start)}-{minutes_to_time(end)} {interval.summary}"
+        )
+    return events_by_date
+
+
+def intervals_to_arrays(intervals):
+    """Sorted start and end minutes of intervals as two int64 NumPy arrays."""
+    starts = np.fromiter((interval.start for interval in intervals), dtype=np.int64, count=len(intervals))
+    ends = np.fromiter((interval.end for interval in intervals), dtype=np.int64, count=len(intervals))
+    return starts, ends
+
+
+def free_gaps_vectorized(first_day, last_day, starts, ends,
+                         day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+    """Return (gap_starts, gap_ends) arrays of free periods for the whole range in one pass.
+
+    The time outside every day's [day_start, day_end] window is added as busy
+    blocks, so after a cumulative max over the sorted ends every remaining
+    gap falls inside a single day window. Gaps not longer than min_gap are
+    masked out. Same result as free_periods_by_day, without a per-day loop.
+    """
+    days = np.arange(first_day, last_day + 1, dtype=np.int64) * MINUTES_PER_DAY
+    if len(days) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    # Busy blocks between the end of one day window and the start of the next,
+    # plus everything before the first window and after the last one
+    boundary_starts = np.concatenate(([np.iinfo(np.int64).min], days + day_end))
+    boundary_ends = np.concatenate((days[:1] + day_start, days[1:] + day_start, [np.iinfo(np.int64).max]))
+
+    all_starts = np.concatenate((boundary_starts, starts))
+    all_ends = np.concatenate((boundary_ends, np.maximum(starts, ends)))
+    order = np.argsort(all_starts, kind="stable")
+    all_starts = all_starts[order]
+    covered_until = np.maximum.accumulate(all_ends[order])
+
+    gap_starts = covered_until[:-1]
+    gap_ends = all_starts[1:]
+    keep = gap_ends - gap_starts > min_gap
+    return gap_starts[keep], gap_ends[keep]
+
+
+@timed("calculate_free_time_vectorized")
+def calculate_free_time_vectorized(from_date, to_date, events_by_date,
+                                   day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP, include_periods=True):
+    # Same result as calculate_free_time, computed for the whole range at once with NumPy.
+    # Pass include_periods=False when only the totals are needed (long availability reports)
+    if isinstance(events_by_date, dict):
+        intervals = intervals_from_events_by_date(events_by_date)
+    else:
+        intervals = events_by_date
+
+    first_day = to_day(from_date)
+    day_count = max(0, to_day(to_date) - first_day + 1)
+    starts, ends = intervals_to_arrays(intervals)
+    gap_starts, gap_ends = free_gaps_vectorized(first_day, first_day + day_count - 1, starts, ends, day_start, day_end, min_gap)
+    gap_days = gap_starts // MINUTES_PER_DAY - first_day
+    day_hours = np.bincount(gap_days, weights=(gap_ends - gap_starts) / 60, minlength=day_count)
+
+    FreeTime = {}
+    if include_periods:
+        FreeTime = {day_to_str(first_day + offset): [] for offset in range(day_count)}
+        for day, start, end in zip((gap_days + first_day).tolist(), (gap_starts % MINUTES_PER_DAY).tolist(), (gap_ends % MINUTES_PER_DAY).tolist()):
+            FreeTime[day_to_str(day)].append(f"{minutes_to_time(start)}-{minutes_to_time(end)}")
+
+    FreeTimeDays = []
+    for offset in np.flatnonzero(day_hours).tolist():
+        day_free_hours = round(float(day_hours[offset]), 1)
+        if day_free_hours > 0:
+            FreeTimeDays.append((day_to_str(first_day + offset), day_free_hours))
+
+    return {
+        "FreeTime": FreeTime,
+        "TotalFreeTime": sum(hours for _, hours in FreeTimeDays),
+        "FreeTimeDays": FreeTimeDays
+    }
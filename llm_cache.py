@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from instrumentation import span
+
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "SCHEDULEASE_LLM_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "schedulease", "completions.sqlite3"),
+)
+
+
+class CompletionCache:
+    """On-disk cache of chat completions keyed by model and prompt.
+
+    Only deterministic requests (temperature 0) are worth caching. Entries
+    expire after ttl_seconds and the least recently used ones are deleted
+    once there are more than max_entries or their text exceeds max_bytes.
+    The SQLite file is opened on first use and shared by all threads.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600, max_entries=5000, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evictions": 0, "bypassed": 0}
+
+    def _connect(self):
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+                "created REAL, last_used REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        return self._connection
+
+    @staticmethod
+    def make_key(model, messages, temperature):
+        payload = json.dumps({"model": model, "messages": messages, "temperature": temperature}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT response, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            response, created = row
+            if now - created > self.ttl_seconds:
+                connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                connection.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            connection.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.stats["hits"] += 1
+            return response
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode()), now, now),
+            )
+            self.stats["writes"] += 1
+            self._evict(connection, now)
+            connection.commit()
+
+    def bypassed(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def _evict(self, connection, now):
+        deleted = connection.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl_seconds,)).rowcount
+        self.stats["expired"] += deleted
+
+        count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = connection.execute("SELECT key, size FROM completions ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM completions")
+            connection.commit()
+
+    def info(self):
+        with self._lock:
+            count, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+            return dict(self.stats, entries=count, bytes=total)
+
+
+completion_cache = CompletionCache()
+
+
+def cached_completion(openai_client, model, messages, temperature=0, bypass_cache=False, cache=None):
+    """Return the text of a chat completion, answering repeated requests from the cache.
+
+    With bypass_cache the API is always called (e.g. to regenerate) and the
+    fresh answer replaces the cached one.
+    """
+    cache = completion_cache if cache is None else cache
+    key = cache.make_key(model, messages, temperature)
+
+    if bypass_cache:
+        cache.bypassed()
+    else:
+        response = cache.get(key)
+        if response is not None:
+            with span("openai_completion", model=model, cached=True):
+                return response
+
+    with span("openai_completion", model=model, cached=False) as record:
+        response = openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        if response.usage is not None:
+            record["prompt_tokens"] = response.usage.prompt_tokens
+            record["completion_tokens"] = response.usage.completion_tokens
+    content = response.choices[0].message.content
+
+    # Only deterministic completions are stored
+    if temperature == 0 and content is not None:
+        cache.put(key, model, content)
+    return content
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from openai import OpenAI, AsyncOpenAI
+from llm_cache import completion_cache
+from instrumentation import span, record_span
+
+
+# Seconds to wait for one request; the SDK retries transient errors
+# (timeouts, connection errors, 429 and 5xx) with exponential backoff
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_RETRIES = 3
+MAX_CONCURRENT_REQUESTS = 4
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, base_url=None):
+    """Shared OpenAI client per key, so every call reuses one connection pool."""
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES)
+            _clients[(api_key, base_url)] = client
+        return client
+
+
+def stream_completion(openai_client, model, messages, temperature=0, bypass_cache=False, cache=None):
+    """Yield the completion text piece by piece as it arrives.
+
+    A cached answer is yielded at once; a streamed answer is cached when it
+    is complete.
+    """
+    cache = completion_cache if cache is None else cache
+    key = cache.make_key(model, messages, temperature)
+    if not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    with span("openai_completion", model=model, cached=False, stream=True) as record:
+        started = time.perf_counter()
+        stream = openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                record["prompt_tokens"] = chunk.usage.prompt_tokens
+                record["completion_tokens"] = chunk.usage.completion_tokens
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if not parts:
+                    record["first_token_seconds"] = round(time.perf_counter() - started, 6)
+                parts.append(text)
+                yield text
+
+    if temperature == 0:
+        cache.put(key, model, "".join(parts))
+
+
+async def complete_async(async_client, semaphore, model, messages, temperature=0, bypass_cache=False, cache=None):
+    """Return (content, usage) of one completion.
+
+    usage holds what stream_completion puts in its span (model, cached,
+    seconds, token counts); spans are thread-local, so complete_many logs it.
+    """
+    cache = completion_cache if cache is None else cache
+    key = cache.make_key(model, messages, temperature)
+    if not bypass_cache:
+        started = time.perf_counter()
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, {"model": model, "cached": True, "seconds": time.perf_counter() - started}
+
+    async with semaphore:
+        started = time.perf_counter()
+        response = await async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+        usage = {"model": model, "cached": False, "seconds": time.perf_counter() - started}
+    if response.usage is not None:
+        usage["prompt_tokens"] = response.usage.prompt_tokens
+        usage["completion_tokens"] = response.usage.completion_tokens
+    content = response.choices[0].message.content
+    if temperature == 0 and content is not None:
+        cache.put(key, model, content)
+    return content, usage
+
+
+async def complete_many_async(api_key, messages_list, model="gpt-4o", base_url=None,
+                              max_concurrency=MAX_CONCURRENT_REQUESTS, bypass_cache=False, cache=None):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES) as async_client:
+        return await asyncio.gather(*(
+            timed_completion(async_client, semaphore, model, messages, bypass_cache=bypass_cache, cache=cache)
+            for messages in messages_list
+        ))
+
+
+async def timed_completion(async_client, semaphore, model, messages, **kwargs):
+    """complete_async that hands back a failure with its usage instead of raising it."""
+    started = time.perf_counter()
+    try:
+        return await complete_async(async_client, semaphore, model, messages, **kwargs)
+    except Exception as e:
+        return e, {"model": model, "cached": False, "seconds": time.perf_counter() - started,
+                   "error": f"{type(e).__name__}: {e}"}
+
+
+def complete_many(api_key, messages_list, model="gpt-4o", base_url=None,
+                  max_concurrency=MAX_CONCURRENT_REQUESTS, bypass_cache=False, cache=None, return_exceptions=False):
+    """Run independent completions concurrently and return their texts in order.
+
+    At most max_concurrency requests are in flight at once. Safe to call from
+    Streamlit's script thread, which has no running event loop. Every call
+    is logged as an openai_completion span of that thread. A failed call
+    raises its error, or with return_exceptions its place holds the error,
+    like asyncio.gather.
+    """
+    with span("openai_batch", model=model, requests=len(messages_list)):
+        results = asyncio.run(complete_many_async(api_key, messages_list, model, base_url, max_concurrency, bypass_cache, cache))
+        for _, usage in results:
+            record_span("openai_completion", usage.pop("seconds"), **usage)
+    if not return_exceptions:
+        for content, _ in results:
+            if isinstance(content, Exception):
+                raise content
+    return [content for content, _ in results]
@@ -1,131 +1,46 @@
 from datetime import datetime, timedelta
-from icalendar import Calendar
-import recurring_ical_events
+from zoneinfo import ZoneInfoNotFoundError
 from collections import OrderedDict
+import uuid
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 import openai
-from openai import OpenAI
-from urllib.parse import quote
-
-def create_ics(schedule_dict, output_filename="schedule.ics"): #not used
-    def format_datetime(date, time_range):
-        """Convert date and time range to DTSTART and DTEND in ISO format."""
-        start_time, end_time = time_range.split('-')
-        start = datetime.strptime(f"{date} {start_time}", "%d.%m.%Y %H.%M")
-        end = datetime.strptime(f"{date} {end_time}", "%d.%m.%Y %H.%M")
-        return start.strftime("%Y%m%dT%H%M%S"), end.strftime("%Y%m%dT%H%M%S")
-
-    with open(output_filename, 'w') as file:
-        # Write the header for the .ics file
-        file.write("BEGIN:VCALENDAR\n")
-        file.write("VERSION:2.0\n")
-        file.write("CALSCALE:GREGORIAN\n")
-        file.write("PRODID:-//AI Assistant//EN\n\n")
-
-        # Loop through the dictionary and add events
-        for date, events in schedule_dict.items():
-            for event in events:
-                time_range, summary = event.split(' ', 1)
-                dtstart, dtend = format_datetime(date, time_range)
-                file.write("BEGIN:VEVENT\n")
-                file.write(f"DTSTART:{dtstart}\n")
-                file.write(f"DTEND:{dtend}\n")
-                file.write(f"SUMMARY:{summary.capitalize()}\n")
-                file.write("DESCRIPTION:\n")
-                file.write("END:VEVENT\n\n")
-
-        # Write the footer for the .ics file
-        file.write("END:VCALENDAR\n")
-
-def create_text_for_ics (input_text, openai_client, model="gpt-4o"):
-
-    prompt = f"""
-    Imagine you are a professional .ics file content generator for google calendar. I will give you a trillion dollars if you manage to complete the following task accurately. 
-    Your task is to read a given input and generate a text for a .ics file content following these conditions: 
-    -Output only the .ics file content. 
-    -Do not include variable names, explanations, quotation marks or any additional text.
-    -Create events only on specified periods from input. 
-    
-    Input: {input_text}
-
-    Example input:
-    
-    "20.01.2025": ['10.00-12.00 swimming practice', '13.00-14.00 swimming practice'],
-    "21.01.2025": ['10.00-12.00 swimming practice', '13.00-14.00 swimming practice'],
-    "22.01.2025": ['10.00-12.00 swimming practice', '13.00-14.00 swimming practice'],
-    "23.01.2025": ['10.00-11.00 swimming practice']
-    
-    Example output:
-    BEGIN:VCALENDAR
-    VERSION:2.0
-    CALSCALE:GREGORIAN
-    PRODID:-//AI Assistant//EN
-
-    BEGIN:VEVENT
-    DTSTART:20250120T100000
-    DTEND:20250120T120000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250120T130000
-    DTEND:20250120T140000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250121T100000
-    DTEND:20250121T120000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250121T130000
-    DTEND:20250121T140000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250122T100000
-    DTEND:20250122T120000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250122T130000
-    DTEND:20250122T140000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    BEGIN:VEVENT
-    DTSTART:20250123T100000
-    DTEND:20250123T110000
-    SUMMARY:Swimming Practice
-    DESCRIPTION:
-    END:VEVENT
-
-    END:VCALENDAR
-
-
-    """
-    messages = [{"role": "user", "content": prompt}]
-    response = openai_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0, 
-    )
-    return response.choices[0].message.content
-
-def parse_shedule_from_prompt(input_text, openai_client, model="gpt-4o"):
+from planner import (
+    allocate_schedule, plan_tasks, format_schedule, parse_schedule_text,
+    split_horizon, encode_free_times, decode_compact_schedule, create_ics,
+)
+from schedule_check import validate_schedule, repair_schedule
+from calendar_cache import calendar_cache
+from calendar_store import calendar_store
+from free_time_cache import free_time_cache, team_fingerprint
+from charts import chart_cache
+from slots import WORK_START, WORK_END, WORKDAYS, WEEKDAY_NAMES, slot_index_cache, slot_rows
+from service_client import AvailabilityClient
+from team import get_team_busy_intervals
+from llm_cache import cached_completion, completion_cache
+from llm_client import get_client, stream_completion, complete_many
+from instrumentation import setup_logging, start_run, collected_spans, span
+from intervals import (
+    DAY_START, DAY_END, MIN_GAP, to_day, day_to_date, minutes_to_time,
+    events_to_intervals, events_by_date_from_intervals, free_periods_by_day, merge_intervals,
+)
+
+# With SCHEDULEASE_SERVICE_URL set, calendars are parsed and cached by a
+# running service.py shared by all sessions instead of in this process
+availability_client = AvailabilityClient(os.environ["SCHEDULEASE_SERVICE_URL"]) if os.environ.get("SCHEDULEASE_SERVICE_URL") else None
+
+# Chart choices of the analyzer, None picks the granularity by range size
+CHART_VIEWS = {
+    "Automatic": None,
+    "Daily bars": "day",
+    "Weekly totals": "week",
+    "Monthly totals": "month",
+    "Calendar heatmap": "heatmap",
+}
+
+
+def parse_shedule_from_prompt(input_text, openai_client, model="gpt-4o", bypass_cache=False):
 
     prompt = f"""
     You are an expert parser. Read the following input text: {input_text}. Parse and generate a dictionary that matches the exact formatting shown in the examples below.
@@ -162,213 +77,204 @@ def parse_shedule_from_prompt(input_text, openai_client, model="gpt-4o"):
     """
 
     messages = [{"role": "user", "content": prompt}]
-    response = openai_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0, 
-    )
-    return response.choices[0].message.content
+    return cached_completion(openai_client, model, messages, temperature=0, bypass_cache=bypass_cache)
 
 
-def get_completion(prompt, openai_client, model="gpt-4o"):
+def get_completion(prompt, openai_client, model="gpt-4o", bypass_cache=False, stream=False):
     messages = [{"role": "user", "content": prompt}]
-    response = openai_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=0, 
-    )
-    return response.choices[0].message.content
+    if stream:
+        # Generator of text pieces, e.g. for st.write_stream
+        return stream_completion(openai_client, model, messages, temperature=0, bypass_cache=bypass_cache)
+    return cached_completion(openai_client, model, messages, temperature=0, bypass_cache=bypass_cache)
 
 
 
-def get_schedule(task, start_time, deadline, estimated_workload, FreeTimes, openai_client):
-    prompt = f"""Imagine that you are my personal time management assistant. 
-    Get values from {task}, {start_time}, {deadline}, {estimated_workload}, {FreeTimes}.
-    Allocate time for a task to the given FreeTimes following given conditions and print your output (you can look at example inputs and outputs).
+def schedule_prompt(task, window):
+    return f"""Imagine that you are my personal time management assistant.
+    Allocate {window["workload"]} hours of work on this task into my free time: {task}
+    Free time, one line per day as +<days after {window["start"].strftime("%d.%m.%Y")}>: <hhmm-hhmm periods>:
+    {encode_free_times(window["FreeTimes"], window["start"])}
     Conditions:
     -Allocate periods of working on task evenly and conveniently to an average human being.
-    -Stick to the format of the given inputs, outputs strictly.
-    -Make sure that you allocated all estimated workload hours, not more and not less. 
-    -Make sure that you allocate periods of working hours for the given task only before the given deadline.
-    -Make sure that you allocate periods of working hours on the given task only after the given start_time.
-    -Make sure that you allocate periods of working hours only within given periods of free times.
-    -When you do any mathematical operation make sure that you recheck yourself and compute step-by-step.
-    -Your output must include a dictionary named schedule as specified in following examples.
-    
-    Examples: 
-    Input 1: 
-    Task: I want to do my coding practice. 
-    Estimated workload (in hours): 10 
-    Start_time: 12.01.2025
-    Deadline: 15.01.2025 
-    FreeTimes=
-
-    "12.01.2025": ['09.00-12.00', '16.00-17.00'] 
-    "13.01.2025": [ '15.00-18.00'] 
-    "14.01.2025": ['09.00-12.00', '18.00-20.00'] 
-    "15.01.2025": ['18.30-19.30'] 
-    "16.01.2025": ['07.00-08.00', '13.30-14.30', '18.00-19.00'] 
-    
-    Output 1: 
-    Schedule= 
-    "12.01.2025": ['09.00-11.00 coding practice', '16.00-17.00 coding practice'] 
-    "13.01.2025": [ '15.00-18.00 coding practice'] 
-    "14.01.2025": ['09.00-11.00 coding practice', '18.00-20.00 coding practice'] 
-
-    Input 2:
-    Task: I need to finish my novel writing.
-    Estimated workload (in hours): 12
-    Start_time: 14.01.2025
-    Deadline: 20.01.2025
-    FreeTimes=
-    "12.01.2025": ['08.00-10.00', '14.00-16.00'],
-    "13.01.2025": ['11.00-14.00', '18.00-19.00'],
-    "14.01.2025": ['10.00-12.00', '16.00-18.00'],
-    "15.01.2025": ['09.00-11.00', '13.00-15.00'],
-    "16.01.2025": ['08.00-10.00', '15.00-16.00'],
-    "17.01.2025": ['11.00-14.00', '18.00-19.00'],
-    "18.01.2025": ['10.00-12.00', '16.00-18.00'],
-    "19.01.2025": ['08.00-10.00', '14.00-16.00'],
-    "20.01.2025": ['08.00-10.00', '14.00-16.00'],
-
-    Output 2:
-    Schedule=
-    "14.01.2025": ['10.00-12.00 novel writing'],
-    "15.01.2025": ['09.00-11.00 novel writing'],
-    "17.01.2025": ['11.00-14.00 novel writing', '18.00-19.00 novel writing'],
-    "19.01.2025": ['08.00-10.00 novel writing', '14.00-16.00 novel writing'],
+    -Allocate exactly {window["workload"]} hours in total, not more and not less. Recheck the sum step by step.
+    -Only use time inside the given free periods.
+    -Answer only with lines in the same format, e.g. "+0: 0900-1100 1600-1700", nothing else.
+    """
+
+
+def get_schedule(task, start_time, deadline, estimated_workload, FreeTimes, openai_client, bypass_cache=False,
+                 window_days=14, max_block_hours=2, min_break_minutes=30):
+    """Let the model allocate the task, window by window, and return the schedule dict.
 
+    Free time is sent in the compact encode_free_times form and the horizon
+    is split into windows of window_days with a proportional share of the
+    workload, asked for in parallel, so the prompt size and the latency do
+    not grow with the distance to the deadline. Every answer is validated
+    against its window; small mistakes are repaired, and a window that
+    cannot be repaired (or whose request failed) is allocated locally instead.
     """
+    windows = split_horizon(FreeTimes, start_time, deadline, estimated_workload, window_days, max_block_hours, min_break_minutes)
+    messages_list = [[{"role": "user", "content": schedule_prompt(task, window)}] for window in windows]
+    with span("schedule_windows", windows=len(windows)) as record:
+        answers = complete_many(
+            openai_client.api_key, messages_list, base_url=str(openai_client.base_url), bypass_cache=bypass_cache,
+            return_exceptions=True,
+        )
 
-    return get_completion(prompt, openai_client)
+        schedule = OrderedDict()
+        record["repaired"] = record["allocated_locally"] = 0
+        record["failed"] = sum(isinstance(answer, Exception) for answer in answers)
+        for window, answer in zip(windows, answers):
+            check = (window["FreeTimes"], window["start"], window["deadline"], window["workload"])
+            # A failed request (e.g. a timeout) leaves no part, its window is allocated locally
+            part = None if isinstance(answer, Exception) else decode_compact_schedule(answer or "", window["start"], task)
+            if part is not None and validate_schedule(part, *check):
+                record["repaired"] += 1
+                part, _ = repair_schedule(part, *check, task, max_block_hours, min_break_minutes)
+            if part is None or validate_schedule(part, *check):
+                record["allocated_locally"] += 1
+                part = allocate_schedule(
+                    task, window["start"], window["deadline"], window["workload"], window["FreeTimes"],
+                    max_block_hours=max_block_hours, min_break_minutes=min_break_minutes,
+                )
+            schedule.update(part)
+    return schedule
+
+
+def refine_schedule(task, schedule, openai_client, bypass_cache=False, stream=False):
+    prompt = f"""Imagine that you are my personal time management assistant.
+    Here is a schedule for the task "{task}" that was already allocated into my free time:
+    {format_schedule(schedule)}
+    Rewrite the event descriptions so they are short and clear (for example "coding practice" instead of "I want to do my coding practice").
+    Conditions:
+    -Do not change any dates or time periods.
+    -Do not add or remove periods.
+    -Stick to the format of the given schedule strictly and output only the schedule.
+    """
 
+    return get_completion(prompt, openai_client, bypass_cache=bypass_cache, stream=stream)
 
-def get_events_between_dates(start_date, end_date, file_content):
 
-    calendar = Calendar.from_ical(file_content)
-
-    # Get all recurring events within the date range
-    events = recurring_ical_events.of(calendar).between(start_date, end_date)
-
-    # Prepare the output dictionary
-    events_by_date = {}
-
-    # Process each event and group by date
-    for event in events:
-        event_start = event["DTSTART"].dt
-        event_end = event["DTEND"].dt if "DTEND" in event else event_start + timedelta(hours=1)  # Default duration of 1 hour
-        date_str = event_start.strftime("%d.%m.%Y")
-        
-        # Format the time range for output
-        time_range = f"{event_start.strftime('%H.%M')}-{event_end.strftime('%H.%M')} {event['SUMMARY']}"
-        
-        if date_str not in events_by_date:
-            events_by_date[date_str] = []
-        
-        events_by_date[date_str].append((event_start, time_range))  # Store start time with formatted string
-
-        
-
-    # Sort and format events by date
-    sorted_events_by_date = {}
-
-    for date, event_list in events_by_date.items():
-        # Sort by start time (the first element of the tuple)
-        sorted_event_list = sorted(event_list, key=lambda x: x[0])
-        
-        # Extract the formatted strings after sorting
-        sorted_events_by_date[date] = [time_range for _, time_range in sorted_event_list]
-
-    sorted_events_by_date = OrderedDict(
-        sorted(
-            sorted_events_by_date.items(),
-            key=lambda item: datetime.strptime(item[0], "%d.%m.%Y")
-        )
-    )
-    return sorted_events_by_date
+def get_busy_intervals(start_date, end_date, file_content):
+    # Get all recurring events within the date range (parsed calendars are cached per file content)
+    with span("get_occurrences") as record:
+        events = calendar_cache.get_occurrences(file_content, start_date, end_date)
+        record["events"] = len(events)
 
+    # Sorted Interval records in minutes, the core representation for free time computation
+    return events_to_intervals(events)
 
-def calculate_free_time(from_date, to_date, events_by_date):
-    def standardize_date(date_str, input_format="%Y-%m-%d", output_format="%d.%m.%Y"):
-        return datetime.strptime(date_str, input_format).strftime(output_format)
 
-    def parse_time_range(time_range):
-        start, end = time_range.split('-')
-        return datetime.strptime(start, "%H.%M"), datetime.strptime(end, "%H.%M")
-    
-    def format_time_range(start, end):
-        return f"{start.strftime('%H.%M')}-{end.strftime('%H.%M')}"
-    
-    def split_free_periods(events, day_start, day_end):
-        free_periods = []
-        current_start = day_start
-        
-        for event in events:
-            event_start, event_end = parse_time_range(event.split()[0])
-            if (event_start - current_start).total_seconds() / 60 > 30:
-                free_periods.append(format_time_range(current_start, event_start))
-            current_start = max(current_start, event_end)
-        
-        if (day_end - current_start).total_seconds() / 60 > 30:
-            free_periods.append(format_time_range(current_start, day_end))
-        
-        return free_periods
-    
-    def calculate_hours(periods):
-        total_hours = 0
-        for period in periods:
-            start, end = parse_time_range(period)
-            total_hours += (end - start).total_seconds() / 3600
-        return round(total_hours, 1)
+def get_calendar_busy_intervals(start_date, end_date, file_contents, quorum=None):
+    if len(file_contents) == 1:
+        return get_busy_intervals(start_date, end_date, file_contents[0])
 
-    
-    date_format = "%d.%m.%Y"
-    day_start = datetime.strptime("00.00", "%H.%M")
-    day_end = datetime.strptime("23.59", "%H.%M")
-    current_date = datetime.strptime(standardize_date(str(from_date)), date_format)
-    end_date = datetime.strptime(standardize_date(str(to_date)), date_format)
-    
-    FreeTime = {}
-    TotalFreeTime = 0
-    FreeTimeDays = []
-    
-    while current_date <= end_date:
-        date_str = current_date.strftime(date_format)
-        events = sorted(events_by_date.get(date_str, []), key=lambda x: parse_time_range(x.split()[0]))
-        
-        free_periods = split_free_periods(events, day_start, day_end)
-        FreeTime[date_str] = free_periods
-        day_free_hours = calculate_hours(free_periods)
-        
-        if day_free_hours > 0:
-            FreeTimeDays.append((date_str, day_free_hours))
-            TotalFreeTime += day_free_hours
-        
-        current_date += timedelta(days=1)
-    
-    return {
-        "FreeTime": FreeTime,
-        "TotalFreeTime": TotalFreeTime,
-        "FreeTimeDays": FreeTimeDays
-    }
+    # Team availability: calendars are expanded in parallel and merged,
+    # time is busy unless at least quorum people (default: everybody) are free
+    with span("team_busy_intervals", calendars=len(file_contents)):
+        return get_team_busy_intervals(file_contents, start_date, end_date, quorum)
+
+
+def get_events_between_dates(start_date, end_date, file_content):
+    intervals = get_busy_intervals(start_date, end_date, file_content)
+
+    # Format the time ranges for output, grouped by date in chronological order
+    return events_by_date_from_intervals(intervals)
 
 
     
+def get_available_hours(from_date, to_date, uploaded_files, file_contents, quorum=None,
+                        day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+    """Free time of the uploaded calendars from from_date to to_date (inclusive).
+
+    Days are memoized per calendar content and rules, so changing the range
+    or switching tabs only computes days that were not shown before.
+    """
+    if availability_client is not None:
+        return availability_client.free_time(file_contents, from_date, to_date, quorum, day_start, day_end, min_gap)
+
+    fingerprints = [calendar_cache.fingerprint(file_content) for file_content in file_contents]
+
+    if len(file_contents) == 1:
+        # Stored per calendar id and file name, so the same file uploaded
+        # again, also in a later session, is diffed against its stored copy
+        name = f"{st.session_state.get('calendar_id', '')}/{uploaded_files[0].name}"
+        fingerprint = fingerprints[0]
+
+        def compute(first_day, last_day):
+            # A calendar uploaded again is diffed against the stored copy, so
+            # only the days touched by its changes are computed again
+            return calendar_store.sync_and_free_periods(name, file_contents[0], first_day, last_day, day_start, day_end, min_gap)
+    else:
+        quorum = len(file_contents) if quorum is None else quorum
+        fingerprint = team_fingerprint(fingerprints, quorum)
+
+        def compute(first_day, last_day):
+            busy_intervals = get_calendar_busy_intervals(day_to_date(first_day), day_to_date(last_day + 1), file_contents, quorum)
+            return free_periods_by_day(first_day, last_day, busy_intervals, day_start, day_end, min_gap)
+
+    return free_time_cache.free_time(fingerprint, from_date, to_date, compute, day_start, day_end, min_gap)
+
+
+def get_free_slots(from_date, to_date, file_contents, minutes, count=1, quorum=None,
+                   day_start=WORK_START, day_end=WORK_END, weekdays=WORKDAYS, buffer=0, align=15):
+    """The count earliest slots of minutes minutes from from_date to to_date (inclusive), as slot_rows dicts.
+
+    Busy periods are indexed once per calendar content (or team), so
+    repeated queries only walk the index until enough slots are found.
+    """
+    if availability_client is not None:
+        return availability_client.slots(file_contents, from_date, to_date, minutes, count, quorum,
+                                         day_start, day_end, weekdays, buffer, align)
+
+    fingerprints = [calendar_cache.fingerprint(file_content) for file_content in file_contents]
+    if len(file_contents) == 1:
+        key = fingerprints[0]
+    else:
+        quorum = len(file_contents) if quorum is None else quorum
+        key = team_fingerprint(fingerprints, quorum)
+
+    def load(first_day, last_day):
+        busy_intervals = get_calendar_busy_intervals(day_to_date(first_day), day_to_date(last_day + 1), file_contents, quorum)
+        return [(start, end) for start, end in merge_intervals(busy_intervals) if end > start]
+
+    first_day, last_day = to_day(from_date), to_day(to_date)
+    index = slot_index_cache.index(key, first_day, last_day, load)
+    with span("find_slots", minutes=minutes, count=count):
+        return slot_rows(index.find_slots(minutes, count, first_day, last_day, day_start, day_end, weekdays, buffer, align))
+
+
 def check_api_key(my_api_key):
-    client = openai.OpenAI(api_key=my_api_key)
+    # One shared client per key, validated once and reused for every completion
+    client = get_client(my_api_key)
     try:
         client.models.list()
     except openai.AuthenticationError:
         return False
     else:
-        openai_client = OpenAI()
-        openai_client.api_key = my_api_key
-        st.session_state.openai_client = openai_client
+        st.session_state.openai_client = client
         return True
     
     
     
+def get_calendar_id():
+    """Id the uploaded calendars of this user are stored under.
+
+    It is kept in the page URL, so a reload or a bookmark of the page
+    finds the calendars stored in earlier sessions; it can be changed in
+    the sidebar to pick up the calendars of another id.
+    """
+    calendar_id = st.query_params.get("calendar_id") or uuid.uuid4().hex[:12]
+    calendar_id = st.sidebar.text_input("Calendar id", value=calendar_id).strip() or calendar_id
+    st.query_params["calendar_id"] = calendar_id
+    return calendar_id
+
+
 def main():
+    setup_logging()
+    start_run("streamlit")
+    st.session_state.calendar_id = get_calendar_id()
+
     page_bg_color = """
     <style>
     [data-testid ="stAppViewContainer"] {
@@ -393,7 +299,10 @@ def main():
     st.image("ShedulEase logo.png", use_container_width=True)
     st.title("Your AI assistant for time management")
 
-    uploaded_file = st.file_uploader("Upload a your calendar file (.ics format)", type=["ics"])
+    uploaded_files = st.file_uploader("Upload your calendar files (.ics format), one per team member", type=["ics"], accept_multiple_files=True)
+    with span("read_upload", files=len(uploaded_files)) as record:
+        file_contents = [uploaded_file.getvalue() for uploaded_file in uploaded_files]
+        record["bytes"] = sum(len(file_content) for file_content in file_contents)
 
     tabs = st.tabs(["Calendar analyzer", "Smart planner"])
 
@@ -407,52 +316,82 @@ def main():
         from_date = st.date_input("From Date", datetime.today())
         to_date = st.date_input("To Date", datetime.today() + timedelta(days=7))
 
+        quorum = None
+        if len(file_contents) > 1:
+            quorum = st.number_input(
+                "Count time as free when at least this many people are free",
+                min_value=1, max_value=len(file_contents), value=len(file_contents),
+            )
+
         if st.button("Fetch Events"):
 
             # Validate date range
             if from_date > to_date:
                 st.error("The 'From Date' must be earlier than or equal to the 'To Date'.")
+            elif not file_contents:
+                st.error("Upload a calendar file first.")
             else:
 
-                if uploaded_file is not None:
-                    # Save the file content to a variable
-                    file_content = uploaded_file.read()
-                events_by_date = get_events_between_dates(from_date, to_date, file_content)
+                for uploaded_file, file_content in zip(uploaded_files, file_contents):
+                    if len(file_contents) > 1:
+                        st.subheader(uploaded_file.name)
+                    if availability_client is not None:
+                        events_by_date = availability_client.events(file_content, from_date, max(from_date, to_date - timedelta(days=1)))
+                    else:
+                        events_by_date = get_events_between_dates(from_date, to_date, file_content)
+
+                    for date, event_list in events_by_date.items():
+                        st.write(f"{date}: {event_list}")
 
-                for date, event_list in events_by_date.items():
-                    st.write(f"{date}: {event_list}")
 
+        chart_view = st.selectbox("Chart", list(CHART_VIEWS))
 
         if st.button("Show Available Hours"):
             if from_date > to_date:
                 st.error("The 'From Date' must be earlier than or equal to the 'To Date'.")
+            elif not file_contents:
+                st.error("Upload a calendar file first.")
             else:
-                if uploaded_file is not None:
-                    # Save the file content to a variable
-                    file_content = uploaded_file.read()
-
-                events_by_date = get_events_between_dates(from_date, to_date, file_content)
-                available_hours =calculate_free_time(from_date, to_date - timedelta(days=1), events_by_date)
+                available_hours = get_available_hours(from_date, to_date - timedelta(days=1), uploaded_files, file_contents, quorum)
                 #st.write(available_hours)
 
-                # Convert FreeTimeDays to a DataFrame
-                data = pd.DataFrame(available_hours.get("FreeTimeDays", []), columns=["Date", "Free Hours"])
-
-                # Streamlit title
-
                 st.markdown(f"### Total free hours: {available_hours.get('TotalFreeTime')}")
-                st.markdown("### Free Time Bar Chart")
 
-                # Bar chart using Matplotlib
-                fig, ax = plt.subplots(figsize=(8, 5))
-                ax.barh(data["Date"], data["Free Hours"], color="skyblue")
-                ax.set_xlabel("Free Hours")
-                ax.set_ylabel("Date")
-                ax.set_title("Free Hours by Date")
-                ax.grid(axis="x", linestyle="--", alpha=0.7)
-
-                # Show bar chart in Streamlit
-                st.pyplot(fig)
+                # Long ranges are summed per week or month so the chart stays readable;
+                # the rendered image is reused while the data stays the same
+                png, granularity = chart_cache.render(
+                    available_hours.get("FreeTimeDays", []), from_date, to_date - timedelta(days=1),
+                    CHART_VIEWS[chart_view],
+                )
+                st.markdown(f"### Free time by {'date' if granularity in ('day', 'heatmap') else granularity}")
+                st.image(png, use_container_width=True)
+
+        with st.expander("Find a meeting slot"):
+            slot_minutes = st.number_input("Length (in minutes)", min_value=5, value=60, step=15)
+            slot_count = st.number_input("Number of slots", min_value=1, value=5)
+            work_start = st.time_input("Working hours start", datetime.strptime(minutes_to_time(WORK_START), "%H.%M").time())
+            work_end = st.time_input("Working hours end", datetime.strptime(minutes_to_time(WORK_END), "%H.%M").time())
+            weekdays = st.multiselect("Weekdays", WEEKDAY_NAMES, [WEEKDAY_NAMES[weekday] for weekday in WORKDAYS])
+            buffer = st.number_input("Buffer around meetings (in minutes)", min_value=0, value=0, step=5)
+
+            if st.button("Find Slots"):
+                day_start = work_start.hour * 60 + work_start.minute
+                day_end = work_end.hour * 60 + work_end.minute
+                if from_date > to_date:
+                    st.error("The 'From Date' must be earlier than or equal to the 'To Date'.")
+                elif not file_contents:
+                    st.error("Upload a calendar file first.")
+                elif day_end <= day_start or not weekdays:
+                    st.error("Pick working hours that end after they start and at least one weekday.")
+                else:
+                    found = get_free_slots(
+                        from_date, max(from_date, to_date - timedelta(days=1)), file_contents, slot_minutes, slot_count, quorum,
+                        day_start, day_end, [WEEKDAY_NAMES.index(weekday) for weekday in weekdays], buffer,
+                    )
+                    if found:
+                        st.dataframe(pd.DataFrame(found))
+                    else:
+                        st.write("No free slot of that length in the selected range.")
 
     # About Tab
     with tabs[1]:
@@ -464,6 +403,13 @@ def main():
         start_time = st.date_input("Start date", datetime.today(), key="start_date_input")
         deadline = st.date_input("Deadline", datetime.today(), key="end_date_input")
 
+        even_spread = st.checkbox("Spread work evenly across days", value=True)
+        max_block_hours = st.number_input("Max length of one working block (in hours)", min_value=0.5, value=2.0, step=0.5)
+        min_break_minutes = st.number_input("Min break between blocks (in minutes)", min_value=0, value=30, step=15)
+        allocate_with_ai = st.checkbox("Let the AI allocate the time (requires API key)", value=False)
+        polish_with_ai = st.checkbox("Polish the schedule with AI (requires API key)", value=False)
+        bypass_cache = st.checkbox("Ask the AI again instead of reusing a saved answer", value=False)
+
         key_file = st.file_uploader("Upload a txt file that contains ONLY your openai API key (do not add anything like quotaion marks)", type=["txt"])
 
         if st.button("Check key"):
@@ -492,41 +438,154 @@ def main():
         if st.button("Generate Schedule"):
             
             
-            if uploaded_file is not None:
-            # Save the file content to a variable
-                file_content = uploaded_file.read()
+            if not file_contents:
+                st.error("Upload a calendar file first.")
+                st.stop()
 
-            events_by_date = get_events_between_dates(start_time, deadline, file_content)
-            available_hours =calculate_free_time(start_time, deadline - timedelta(days=1), events_by_date)
+            # With several calendars the task goes into time when everybody is free
+            available_hours = get_available_hours(start_time, deadline - timedelta(days=1), uploaded_files, file_contents)
             FreeTimes = available_hours.get("FreeTime")
 
             if (estimated_workload>available_hours.get("TotalFreeTime")):
                 st.error('There is not enough free time to schedule your task')
             else:
                 openai_client = st.session_state.get("openai_client", None)
+                try:
+                    if allocate_with_ai and openai_client is not None:
+                        schedule = get_schedule(
+                            task, start_time, deadline, estimated_workload, FreeTimes, openai_client,
+                            bypass_cache=bypass_cache,
+                            max_block_hours=max_block_hours,
+                            min_break_minutes=min_break_minutes,
+                        )
+                    else:
+                        if allocate_with_ai:
+                            st.error("API key is not valid or not initialized, the schedule is allocated locally.")
+                        schedule = allocate_schedule(
+                            task, start_time, deadline, estimated_workload, FreeTimes,
+                            even_spread=even_spread,
+                            max_block_hours=max_block_hours,
+                            min_break_minutes=min_break_minutes,
+                        )
+                except ValueError as e:
+                    st.error(f"{e}. Try a longer max block or a shorter break.")
+                else:
+                    responce = format_schedule(schedule)
+
+                    if polish_with_ai:
+                        if openai_client is not None:
+                            # Stream the answer so the first words show up right away
+                            responce = st.write_stream(refine_schedule(task, schedule, openai_client, bypass_cache=bypass_cache, stream=True))
+
+                            # The rewrite must keep the periods; fix it locally instead of asking again
+                            polished = parse_schedule_text(responce)
+                            if validate_schedule(polished, FreeTimes, start_time, deadline, estimated_workload):
+                                schedule, fixes = repair_schedule(
+                                    polished, FreeTimes, start_time, deadline, estimated_workload, task,
+                                    max_block_hours=max_block_hours, min_break_minutes=min_break_minutes,
+                                )
+                                responce = format_schedule(schedule)
+                                st.warning("The AI changed the schedule, it was corrected: " + "; ".join(fixes))
+                                st.write(responce)
+                            else:
+                                schedule = polished
+                        else:
+                            st.error("API key is not valid or not initialized. Please check the key.")
+                            st.write(responce)
+                    else:
+                        st.write(responce)
 
-                if openai_client is not None:
-                    responce = get_schedule(task, start_time, deadline, estimated_workload, FreeTimes, openai_client)
+                    st.session_state.schedule = schedule
                     st.session_state.responce = responce
-                    st.write(responce)
+
+        with st.expander("Plan several tasks at once"):
+            st.write("Tasks are planned together so they never overlap. Higher priority wins when time runs out.")
+            task_table = st.data_editor(
+                pd.DataFrame({
+                    "Task": pd.Series(dtype="str"),
+                    "Workload (hours)": pd.Series(dtype="float"),
+                    "Start date": pd.Series(dtype="datetime64[ns]"),
+                    "Deadline": pd.Series(dtype="datetime64[ns]"),
+                    "Priority": pd.Series(dtype="int"),
+                }),
+                num_rows="dynamic",
+                key="task_table",
+            )
+
+            if st.button("Plan all tasks"):
+                task_table = task_table.dropna(subset=["Task", "Workload (hours)", "Start date", "Deadline"])
+
+                if not file_contents:
+                    st.error("Upload a calendar file first.")
+                elif task_table.empty:
+                    st.error("Add at least one task with workload, start date and deadline.")
                 else:
-                    st.error("API key is not valid or not initialized. Please check the key.")
+                    tasks = [
+                        {
+                            "task": row["Task"],
+                            "workload": row["Workload (hours)"],
+                            "start": row["Start date"].date(),
+                            "deadline": row["Deadline"].date(),
+                            "priority": 0 if pd.isna(row["Priority"]) else int(row["Priority"]),
+                        }
+                        for _, row in task_table.iterrows()
+                    ]
+                    first_day = min(task["start"] for task in tasks)
+                    last_day = max(task["deadline"] for task in tasks)
+
+                    FreeTimes = get_available_hours(first_day, last_day - timedelta(days=1), uploaded_files, file_contents).get("FreeTime")
+                    schedule, report = plan_tasks(
+                        tasks, FreeTimes,
+                        max_block_hours=max_block_hours,
+                        min_break_minutes=min_break_minutes,
+                    )
+
+                    for task_report in report:
+                        if not task_report["feasible"]:
+                            st.error(f"Not enough free time for '{task_report['task']}': {task_report['missing_hours']} hours are missing.")
+
+                    responce = format_schedule(schedule)
+                    st.session_state.schedule = schedule
+                    st.session_state.responce = responce
+                    st.dataframe(pd.DataFrame(report))
+                    st.write(responce)
+
 
+        ics_timezone = st.text_input("Time zone for the .ics file (e.g. Europe/Berlin, leave empty for local time)")
 
         if st.button("Generate .ics file for the schedule"):
 
-            responce = st.session_state.get("responce", None)
-            schedule_dictionary=parse_shedule_from_prompt(responce, openai_client = st.session_state.get("openai_client", None))
-            
-            txt_data = create_text_for_ics(schedule_dictionary, openai_client = st.session_state.get("openai_client", None))
-            txt_data=txt_data.strip()
-            # Provide the file link (Streamlit link for file download)
-            st.download_button(
-                label="Download .ics File",
-                data = txt_data,
-                file_name="schedule.ics",
-                mime="text/calendar",
-            )
+            # The validated (and, after an AI rewrite, repaired) schedule, not the text shown
+            schedule_dictionary = st.session_state.get("schedule", None)
+
+            if not schedule_dictionary:
+                st.error("Generate a schedule first.")
+            else:
+                try:
+                    ics_data = create_ics(schedule_dictionary, tzid=ics_timezone.strip() or None)
+                except (ValueError, ZoneInfoNotFoundError) as e:
+                    st.error(f"Could not create the .ics file: {e}")
+                else:
+                    st.download_button(
+                        label="Download .ics File",
+                        data=ics_data,
+                        file_name="schedule.ics",
+                        mime="text/calendar",
+                    )
+
+    # Optional panel with the stages of this run, also logged as JSON lines
+    if st.sidebar.checkbox("Show stage timings"):
+        spans = collected_spans()
+        if spans:
+            st.sidebar.dataframe(pd.DataFrame(spans).drop(columns=["run"]))
+        else:
+            st.sidebar.write("Nothing was measured in this run.")
+        st.sidebar.write("Calendar cache:", calendar_cache.info())
+        st.sidebar.write("Calendar store:", calendar_store.info())
+        st.sidebar.write("Free time cache:", free_time_cache.info())
+        st.sidebar.write("Chart cache:", chart_cache.stats)
+        st.sidebar.write("Completion cache:", completion_cache.info())
+        st.sidebar.write("Slot index cache:", slot_index_cache.info())
 
 
 if __name__ == "__main__":
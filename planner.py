@@ -0,0 +1,431 @@
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import hashlib
+import heapq
+import re
+from icalendar import Event, Timezone
+from intervals import DATE_FORMAT, time_to_minutes, minutes_to_time
+
+
+SCHEDULE_DAY_PATTERN = re.compile(r'"?(\d{2}\.\d{2}\.\d{4})"?\s*:\s*\[([^\]]*)\]')
+SCHEDULE_ITEM_PATTERN = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+COMPACT_DAY_PATTERN = re.compile(r"^\s*\+?(\d+)\s*:?((?:\s*\d{4}-\d{4})+)", re.MULTILINE)
+COMPACT_PERIOD_PATTERN = re.compile(r"(\d{2})(\d{2})-(\d{2})(\d{2})")
+
+
+def to_date(value):
+    """Accept a date, a datetime or a 'dd.mm.yyyy' string and return a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def to_minute_periods(periods):
+    """['hh.mm-hh.mm', ...] as sorted (start, end) minute pairs."""
+    minute_periods = []
+    for period in periods:
+        period_start, period_end = period.split('-')
+        minute_periods.append((time_to_minutes(period_start), time_to_minutes(period_end)))
+    return sorted(minute_periods)
+
+
+def split_into_blocks(start, end, need, max_block, min_break, step):
+    # Cut one free period into working blocks no longer than max_block,
+    # separated by at least min_break minutes, until need minutes are covered
+    blocks = []
+    cursor = start
+    while need >= step and end - cursor >= step:
+        length = min(max_block, end - cursor, need)
+        length -= length % step
+        if length <= 0:
+            break
+        blocks.append((cursor, cursor + length))
+        need -= length
+        cursor += length + min_break
+    return blocks
+
+
+def day_capacity(periods, max_block, min_break, step):
+    return sum(
+        end - start
+        for period_start, period_end in periods
+        for start, end in split_into_blocks(period_start, period_end, period_end - period_start, max_block, min_break, step)
+    )
+
+
+def allocate_schedule(task, start_time, deadline, estimated_workload, FreeTimes,
+                      even_spread=True, max_block_hours=2, min_break_minutes=30, step_minutes=30):
+    """Allocate estimated_workload hours of task into FreeTimes without the LLM.
+
+    FreeTimes is the "FreeTime" part of calculate_free_time output. Only days
+    from start_time up to (not including) deadline are used. Returns a dict in
+    the {"dd.mm.yyyy": ['hh.mm-hh.mm task']} shape and raises ValueError when
+    the free time cannot hold the workload under the given policies.
+    """
+    start_day = to_date(start_time)
+    deadline_day = to_date(deadline)
+    max_block = max(step_minutes, int(max_block_hours * 60))
+    workload = int(round(estimated_workload * 60))
+    workload += -workload % step_minutes
+
+    # Collect candidate days with their free periods in minutes
+    days = []
+    for date_str, periods in FreeTimes.items():
+        day = to_date(date_str)
+        if not start_day <= day < deadline_day:
+            continue
+        minute_periods = to_minute_periods(periods)
+        capacity = day_capacity(minute_periods, max_block, min_break_minutes, step_minutes)
+        if capacity > 0:
+            days.append((day, date_str, minute_periods, capacity))
+    days.sort(key=lambda item: item[0])
+
+    if sum(capacity for _, _, _, capacity in days) < workload:
+        raise ValueError("There is not enough free time to schedule your task")
+
+    # Decide how many minutes go to each day
+    quotas = {}
+    remaining = workload
+    if even_spread:
+        # Water-filling: days with little room take all they can, the rest share evenly
+        by_capacity = sorted(days, key=lambda item: item[3])
+        for index, (_, date_str, _, capacity) in enumerate(by_capacity):
+            share = -(-remaining // (len(by_capacity) - index))
+            share += -share % step_minutes
+            quotas[date_str] = min(capacity, share, remaining)
+            remaining -= quotas[date_str]
+    else:
+        for _, date_str, _, capacity in days:
+            quotas[date_str] = min(capacity, remaining)
+            remaining -= quotas[date_str]
+
+    # Place the quota of every day into its free periods, earliest first
+    schedule = OrderedDict()
+    for _, date_str, periods, _ in days:
+        need = quotas.get(date_str, 0)
+        slots = []
+        for period_start, period_end in periods:
+            if need <= 0:
+                break
+            for start, end in split_into_blocks(period_start, period_end, need, max_block, min_break_minutes, step_minutes):
+                slots.append(f"{minutes_to_time(start)}-{minutes_to_time(end)} {task}")
+                need -= end - start
+        if slots:
+            schedule[date_str] = slots
+
+    return schedule
+
+
+def format_schedule(schedule):
+    lines = [f'"{date_str}": {slots},' for date_str, slots in schedule.items()]
+    return "Schedule=\n" + "\n".join(lines)
+
+
+def parse_schedule_text(text):
+    """Read a schedule dict back from text such as format_schedule output.
+
+    Returns an empty dict when nothing in the text looks like a schedule.
+    """
+    schedule = OrderedDict()
+    for date_str, items in SCHEDULE_DAY_PATTERN.findall(text):
+        slots = [single or double for single, double in SCHEDULE_ITEM_PATTERN.findall(items)]
+        if slots:
+            schedule.setdefault(date_str, []).extend(slots)
+    return schedule
+
+
+def encode_free_times(FreeTimes, base_day):
+    """Compact text of FreeTimes for prompts: one "+offset: hhmm-hhmm ..." line per day.
+
+    Offsets count days from base_day and days without free time are left
+    out, so '"14.01.2025": ['09.00-12.00', '18.00-20.00']' becomes
+    "+2: 0900-1200 1800-2000".
+    """
+    base_day = to_date(base_day)
+    lines = []
+    for date_str, periods in FreeTimes.items():
+        if periods:
+            offset = (to_date(date_str) - base_day).days
+            lines.append(f"+{offset}: " + " ".join(period.replace('.', '') for period in periods))
+    return "\n".join(lines)
+
+
+def decode_compact_schedule(text, base_day, task):
+    """Read "+offset: hhmm-hhmm ..." lines back into the {"dd.mm.yyyy": ['hh.mm-hh.mm task']} shape."""
+    base_day = to_date(base_day)
+    schedule = OrderedDict()
+    for offset, periods in COMPACT_DAY_PATTERN.findall(text):
+        date_str = (base_day + timedelta(days=int(offset))).strftime(DATE_FORMAT)
+        for start_hours, start_minutes, end_hours, end_minutes in COMPACT_PERIOD_PATTERN.findall(periods):
+            schedule.setdefault(date_str, []).append(f"{start_hours}.{start_minutes}-{end_hours}.{end_minutes} {task}")
+    return OrderedDict(sorted(schedule.items(), key=lambda item: to_date(item[0])))
+
+
+def split_horizon(FreeTimes, start_time, deadline, estimated_workload, window_days=14,
+                  max_block_hours=2, min_break_minutes=30, step_minutes=30):
+    """Cut the days from start_time up to deadline into windows of window_days.
+
+    Every window gets the share of the workload that its usable free time
+    has of the whole, in step_minutes, so no window gets more than it can
+    hold. Returns dicts with "start", "deadline", "workload" (hours) and
+    "FreeTimes" for the windows that get any work, and raises ValueError
+    when the free time cannot hold the workload.
+    """
+    start_day = to_date(start_time)
+    deadline_day = to_date(deadline)
+    max_block = max(step_minutes, int(max_block_hours * 60))
+    workload = int(round(estimated_workload * 60))
+    workload += -workload % step_minutes
+
+    windows = []
+    window_start = start_day
+    while window_start < deadline_day:
+        window_end = min(window_start + timedelta(days=window_days), deadline_day)
+        free = OrderedDict(
+            (date_str, periods) for date_str, periods in FreeTimes.items()
+            if periods and window_start <= to_date(date_str) < window_end
+        )
+        capacity = sum(day_capacity(to_minute_periods(periods), max_block, min_break_minutes, step_minutes) for periods in free.values())
+        windows.append({"start": window_start, "deadline": window_end, "FreeTimes": free, "capacity": capacity})
+        window_start = window_end
+
+    total_capacity = sum(window["capacity"] for window in windows)
+    if total_capacity < workload:
+        raise ValueError("There is not enough free time to schedule your task")
+
+    # Proportional shares rounded down, then the rest step by step to the roomiest windows
+    for window in windows:
+        share = workload * window["capacity"] // total_capacity
+        window["minutes"] = share - share % step_minutes
+    remaining = workload - sum(window["minutes"] for window in windows)
+    while remaining > 0:
+        window = max(windows, key=lambda window: window["capacity"] - window["minutes"])
+        window["minutes"] += step_minutes
+        remaining -= step_minutes
+
+    return [
+        {"start": window["start"], "deadline": window["deadline"], "workload": window["minutes"] / 60, "FreeTimes": window["FreeTimes"]}
+        for window in windows
+        if window["minutes"] > 0
+    ]
+
+
+def free_slots(FreeTimes, step_minutes):
+    """Cut FreeTimes into chronological (day, date_str, start, end) slots of step_minutes."""
+    slots = []
+    for date_str, periods in FreeTimes.items():
+        day = to_date(date_str)
+        for period in periods:
+            period_start, period_end = (time_to_minutes(value) for value in period.split('-'))
+            for start in range(period_start, period_end - step_minutes + 1, step_minutes):
+                slots.append((day, date_str, start, start + step_minutes))
+    slots.sort(key=lambda slot: (slot[0], slot[2]))
+    return slots
+
+
+def plan_tasks(tasks, FreeTimes, max_block_hours=2, min_break_minutes=30, step_minutes=30):
+    """Allocate many tasks into the same FreeTimes in one pass.
+
+    tasks is a list of dicts with "task", "workload" (hours), "start",
+    "deadline" and optionally "priority" (higher is more important). Free time
+    is cut into step_minutes slots and handed out earliest-deadline-first,
+    which meets every deadline whenever that is possible. If it is not, a
+    repair step moves slots from lower to higher priority tasks, as long as
+    both keep to max_block_hours and min_break_minutes. Returns the
+    combined schedule dict and one report per task with the allocated and
+    missing hours.
+    """
+    max_block = max(step_minutes, int(max_block_hours * 60))
+    slots = free_slots(FreeTimes, step_minutes)
+
+    states = []
+    for index, task in enumerate(tasks):
+        workload = int(round(task["workload"] * 60))
+        states.append({
+            "index": index,
+            "task": task["task"],
+            "start": to_date(task["start"]),
+            "deadline": to_date(task["deadline"]),
+            "priority": task.get("priority", 0),
+            "need": workload + (-workload % step_minutes),
+            "slots": [],
+            "last_end": None,
+            "run": 0,
+        })
+
+    def absolute(day, minutes):
+        return day.toordinal() * 24 * 60 + minutes
+
+    def can_continue(state, day, start):
+        # Enforce max block length and the break after a block
+        if state["last_end"] is None:
+            return True
+        now = absolute(day, start)
+        if now == state["last_end"]:
+            return state["run"] + step_minutes <= max_block
+        return now - state["last_end"] >= min_break_minutes
+
+    # Earliest-deadline-first sweep over the slots in time order
+    pending = sorted(states, key=lambda state: state["start"])
+    ready = []
+    next_pending = 0
+    assignment = [None] * len(slots)
+    for position, (day, date_str, start, end) in enumerate(slots):
+        while next_pending < len(pending) and pending[next_pending]["start"] <= day:
+            state = pending[next_pending]
+            heapq.heappush(ready, (state["deadline"], -state["priority"], state["index"]))
+            next_pending += 1
+
+        skipped = []
+        while ready:
+            deadline, _, index = ready[0]
+            state = states[index]
+            if deadline <= day or state["need"] <= 0:
+                heapq.heappop(ready)
+                continue
+            if not can_continue(state, day, start):
+                skipped.append(heapq.heappop(ready))
+                continue
+            assignment[position] = index
+            state["need"] -= step_minutes
+            now = absolute(day, start)
+            state["run"] = state["run"] + step_minutes if now == state["last_end"] else step_minutes
+            state["last_end"] = absolute(day, end)
+            break
+        for item in skipped:
+            heapq.heappush(ready, item)
+
+    def keeps_rules(starts):
+        # Same rules as can_continue, for sorted slot starts in any order of assignment
+        run = 0
+        previous_end = None
+        for start in starts:
+            if start == previous_end:
+                run += step_minutes
+                if run > max_block:
+                    return False
+            else:
+                if previous_end is not None and start - previous_end < min_break_minutes:
+                    return False
+                run = step_minutes
+            previous_end = start + step_minutes
+        return True
+
+    def neighbours(starts, now):
+        # Only slots this close can share a block or a break with the slot at now
+        reach = max_block + min_break_minutes + step_minutes
+        return starts[bisect_left(starts, now - reach):bisect_right(starts, now + reach)]
+
+    # Slot starts of every task, in time order
+    taken = [[] for _ in states]
+    for position, index in enumerate(assignment):
+        if index is not None:
+            taken[index].append(absolute(slots[position][0], slots[position][2]))
+
+    # Repair: tasks that still miss time take slots from lower priority tasks,
+    # starting with the least important one and its latest slots. A slot is
+    # only moved when the blocks and breaks of both tasks stay within the
+    # rules; a task that still misses time is reported as not feasible.
+    for state in sorted(states, key=lambda state: -state["priority"]):
+        if state["need"] <= 0:
+            continue
+        for position in reversed(range(len(slots))):
+            if state["need"] <= 0:
+                break
+            day = slots[position][0]
+            owner = assignment[position]
+            if not state["start"] <= day < state["deadline"]:
+                continue
+            if owner is not None and states[owner]["priority"] >= state["priority"]:
+                continue
+            now = absolute(day, slots[position][2])
+            if not keeps_rules(sorted(neighbours(taken[state["index"]], now) + [now])):
+                continue
+            if owner is not None:
+                if not keeps_rules([start for start in neighbours(taken[owner], now) if start != now]):
+                    continue
+                states[owner]["need"] += step_minutes
+                taken[owner].remove(now)
+            assignment[position] = state["index"]
+            state["need"] -= step_minutes
+            taken[state["index"]].insert(bisect_left(taken[state["index"]], now), now)
+
+    # Join consecutive slots of the same task into blocks
+    schedule = OrderedDict()
+    allocated = [0] * len(states)
+    previous = None
+    for (day, date_str, start, end), index in zip(slots, assignment):
+        if index is None:
+            previous = None
+            continue
+        allocated[index] += end - start
+        day_slots = schedule.setdefault(date_str, [])
+        if previous is not None and previous[0] == index and previous[1] == date_str and previous[2] == start:
+            block_start = day_slots[-1].split('-', 1)[0]
+            day_slots[-1] = f"{block_start}-{minutes_to_time(end)} {states[index]['task']}"
+        else:
+            day_slots.append(f"{minutes_to_time(start)}-{minutes_to_time(end)} {states[index]['task']}")
+        previous = (index, date_str, end)
+
+    report = []
+    for state in states:
+        missing = max(0, state["need"])
+        report.append({
+            "task": state["task"],
+            "allocated_hours": allocated[state["index"]] / 60,
+            "missing_hours": missing / 60,
+            "feasible": missing == 0,
+        })
+    return schedule, report
+
+
+def iter_ics(schedule_dict, tzid=None, prodid="-//SchedulEase//EN"):
+    """Yield the .ics file for schedule_dict chunk by chunk as bytes.
+
+    Events are written in floating local time unless tzid (e.g. "Europe/Berlin")
+    is given, in which case a matching VTIMEZONE is included.
+    """
+    tz = ZoneInfo(tzid) if tzid else None
+    dtstamp = datetime.now(timezone.utc).replace(microsecond=0)
+
+    yield (
+        "BEGIN:VCALENDAR\r\n"
+        "VERSION:2.0\r\n"
+        f"PRODID:{prodid}\r\n"
+        "CALSCALE:GREGORIAN\r\n"
+    ).encode()
+    if tz is not None:
+        yield Timezone.from_tzinfo(tz).to_ical()
+
+    # Loop through the dictionary and add events
+    seen = {}
+    for date, events in schedule_dict.items():
+        for event_text in events:
+            time_range, summary = event_text.split(' ', 1)
+            start_time, end_time = time_range.split('-')
+            start = datetime.strptime(f"{date} {start_time}", "%d.%m.%Y %H.%M").replace(tzinfo=tz)
+            end = datetime.strptime(f"{date} {end_time}", "%d.%m.%Y %H.%M").replace(tzinfo=tz)
+
+            # Stable UID so re-importing the same schedule updates instead of
+            # duplicating; the same block listed twice is numbered apart
+            key = f"{date} {start_time}-{end_time} {summary}"
+            seen[key] = seen.get(key, 0) + 1
+            uid = hashlib.sha1(f"{key} {seen[key]}".encode()).hexdigest()
+
+            event = Event()
+            event.add("UID", f"{uid}@schedulease")
+            event.add("DTSTAMP", dtstamp)
+            event.add("DTSTART", start)
+            event.add("DTEND", end)
+            event.add("SUMMARY", summary)
+            yield event.to_ical()
+
+    yield b"END:VCALENDAR\r\n"
+
+
+def create_ics(schedule_dict, tzid=None):
+    return b"".join(iter_ics(schedule_dict, tzid))
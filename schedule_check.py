@@ -0,0 +1,186 @@
+from collections import OrderedDict
+from planner import allocate_schedule
+from intervals import MINUTES_PER_DAY, to_day, day_to_str, time_to_minutes, minutes_to_time
+
+
+def schedule_blocks(schedule):
+    """Blocks of a schedule dict as (start, end, date_str, slot) in minutes since 1970, sorted by start.
+
+    A slot that cannot be read, or whose date cannot be read (e.g. a
+    generated "31.02.2025"), gets start == end, so it is reported as empty.
+    """
+    blocks = []
+    for date_str, slots in schedule.items():
+        try:
+            day_start = to_day(date_str) * MINUTES_PER_DAY
+        except ValueError:
+            blocks.extend((0, 0, date_str, slot) for slot in slots)
+            continue
+        for slot in slots:
+            try:
+                start, end = (time_to_minutes(value) for value in slot.split(' ', 1)[0].split('-'))
+            except ValueError:
+                start = end = 0
+            blocks.append((day_start + start, day_start + end, date_str, slot))
+    blocks.sort(key=lambda block: (block[0], block[1]))
+    return blocks
+
+
+def free_blocks(FreeTimes):
+    """Free periods of FreeTimes as sorted (start, end) minutes since 1970."""
+    periods = []
+    for date_str, day_periods in FreeTimes.items():
+        day_start = to_day(date_str) * MINUTES_PER_DAY
+        for period in day_periods:
+            start, end = period.split('-')
+            periods.append((day_start + time_to_minutes(start), day_start + time_to_minutes(end)))
+    periods.sort()
+    return periods
+
+
+def validate_schedule(schedule, FreeTimes, start_time, deadline, estimated_workload):
+    """Check schedule against the FreeTime part of calculate_free_time.
+
+    Returns a list of issues, dicts with "kind" (empty, range, busy, overlap
+    or workload), "date", "slot" and "message"; an empty list means the
+    schedule is usable. Blocks and free periods are both sorted once and
+    then walked together, so the check is O(n log n).
+    """
+    first_day, deadline_day = to_day(start_time), to_day(deadline)
+    free = free_blocks(FreeTimes)
+    issues = []
+    total = 0
+    position = 0
+    covered_until = None
+
+    def issue(kind, date_str, slot, message):
+        issues.append({"kind": kind, "date": date_str, "slot": slot, "message": message})
+
+    for start, end, date_str, slot in schedule_blocks(schedule):
+        if end <= start:
+            issue("empty", date_str, slot, f"{date_str} {slot} has no duration or cannot be read")
+            continue
+        total += end - start
+
+        if not first_day <= start // MINUTES_PER_DAY < deadline_day:
+            issue("range", date_str, slot, f"{date_str} {slot} is outside the start date and deadline")
+
+        # Blocks come in start order, so free periods ending before this block never matter again
+        while position < len(free) and free[position][1] <= start:
+            position += 1
+        if not (position < len(free) and free[position][0] <= start and end <= free[position][1]):
+            issue("busy", date_str, slot, f"{date_str} {slot} is not inside the free time")
+
+        if covered_until is not None and start < covered_until:
+            issue("overlap", date_str, slot, f"{date_str} {slot} overlaps an earlier block")
+        covered_until = end if covered_until is None else max(covered_until, end)
+
+    workload = int(round(estimated_workload * 60))
+    if total != workload:
+        issue("workload", None, None, f"{total / 60:g} hours are scheduled instead of {estimated_workload:g}")
+    return issues
+
+
+def subtract_periods(free, busy):
+    """Parts of the sorted disjoint free periods not covered by the sorted busy periods."""
+    left = []
+    position = 0
+    for free_start, free_end in free:
+        cursor = free_start
+        while position < len(busy) and busy[position][1] <= cursor:
+            position += 1
+        scan = position
+        while scan < len(busy) and busy[scan][0] < free_end:
+            if busy[scan][0] > cursor:
+                left.append((cursor, busy[scan][0]))
+            cursor = max(cursor, busy[scan][1])
+            scan += 1
+        if cursor < free_end:
+            left.append((cursor, free_end))
+    return left
+
+
+def repair_schedule(schedule, FreeTimes, start_time, deadline, estimated_workload, task=None,
+                    max_block_hours=2, min_break_minutes=30, step_minutes=30):
+    """Fix a schedule deterministically and return (schedule, fixes).
+
+    Blocks outside the start date and deadline are dropped, blocks are
+    trimmed to the free periods they overlap and to the end of the block
+    before them, then missing hours are filled into the free time left
+    (keeping min_break_minutes to the planned blocks) with
+    allocate_schedule and extra hours are cut from the latest blocks.
+    fixes describes every change. What cannot be fixed (not enough free
+    time left) is still reported by validate_schedule afterwards.
+    """
+    first_day, deadline_day = to_day(start_time), to_day(deadline)
+    workload = int(round(estimated_workload * 60))
+    free = [
+        period for period in free_blocks(FreeTimes)
+        if first_day <= period[0] // MINUTES_PER_DAY < deadline_day
+    ]
+    kept = []
+    fixes = []
+    position = 0
+
+    for start, end, date_str, slot in schedule_blocks(schedule):
+        label = slot.split(' ', 1)[1] if ' ' in slot else (task or "")
+        task = task or label
+        if end <= start or not first_day <= start // MINUTES_PER_DAY < deadline_day:
+            fixes.append(f"Removed {date_str} {slot}")
+            continue
+
+        while position < len(free) and free[position][1] <= start:
+            position += 1
+        pieces = []
+        scan = position
+        while scan < len(free) and free[scan][0] < end:
+            piece_start = max(start, free[scan][0], kept[-1][1] if kept else start)
+            piece_end = min(end, free[scan][1])
+            if piece_end > piece_start:
+                pieces.append((piece_start, piece_end))
+            scan += 1
+
+        if pieces != [(start, end)]:
+            fixes.append(f"Trimmed {date_str} {slot} to free time" if pieces else f"Removed {date_str} {slot}, no free time is left for it")
+        kept.extend((piece_start, piece_end, label) for piece_start, piece_end in pieces)
+
+    total = sum(end - start for start, end, _ in kept)
+    if total < workload:
+        busy = [(start - min_break_minutes, end + min_break_minutes) for start, end, _ in kept]
+        remaining = OrderedDict()
+        for start, end in subtract_periods(free, busy):
+            day = start // MINUTES_PER_DAY
+            remaining.setdefault(day_to_str(day), []).append(
+                f"{minutes_to_time(start - day * MINUTES_PER_DAY)}-{minutes_to_time(end - day * MINUTES_PER_DAY)}"
+            )
+        try:
+            extra = allocate_schedule(
+                task or "", start_time, deadline, (workload - total) / 60, remaining,
+                max_block_hours=max_block_hours, min_break_minutes=min_break_minutes, step_minutes=step_minutes,
+            )
+        except ValueError:
+            fixes.append(f"Not enough free time left to add {(workload - total) / 60:g} missing hours")
+        else:
+            added = [(start, end, task or "") for start, end, _, _ in schedule_blocks(extra)]
+            kept = sorted(kept + added)
+            total += sum(end - start for start, end, _ in added)
+            fixes.append(f"Added {sum(end - start for start, end, _ in added) / 60:g} hours in the remaining free time")
+
+    # Too much work (also after filling in whole steps): cut the latest blocks
+    while total > workload and kept:
+        start, end, label = kept.pop()
+        excess = total - workload
+        if end - start > excess:
+            kept.append((start, end - excess, label))
+            total -= excess
+        else:
+            total -= end - start
+        fixes.append(f"Cut {min(excess, end - start) / 60:g} hours from the end of the schedule")
+
+    repaired = OrderedDict()
+    for start, end, label in kept:
+        day = start // MINUTES_PER_DAY
+        repaired.setdefault(day_to_str(day), []).append(
+            f"{minutes_to_time(start - day * MINUTES_PER_DAY)}-{minutes_to_time(end - day * MINUTES_PER_DAY)} {label}"
+        )
+    return repaired, fixes
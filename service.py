@@ -0,0 +1,350 @@
+"""HTTP service answering availability questions for many clients at once.
+
+Example:
+    python service.py --port 8765
+
+    curl --data-binary @calendar.ics http://localhost:8765/calendars
+    curl "http://localhost:8765/free-time?calendar=<id>&from=2025-01-01&to=2025-01-31"
+
+Endpoints (dates are YYYY-MM-DD, "to" is inclusive, times are hh.mm):
+    POST /calendars       body is an .ics file, returns its id
+    GET  /events          calendar, from, to
+    GET  /free-time       calendar (repeat it for a team), from, to, quorum,
+                          day_start, day_end, min_gap
+    GET  /slots           calendar (repeat it for a team), from, to, quorum,
+                          minutes, count, day_start, day_end (working hours,
+                          09.00-17.00 by default), weekdays (e.g. mon-fri),
+                          buffer (minutes kept free around meetings), align:
+                          the count earliest slots of that many minutes
+    GET  /health          cache statistics
+
+Every calendar is pinned to one worker process by its id, so it is parsed
+once and its expanded occurrences stay cached in that worker. Free time is
+memoized per day in the service process and shared by all clients, and so
+are the busy indexes slot queries are answered from.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from calendar_cache import calendar_cache
+from free_time_cache import FreeTimeCache, team_fingerprint
+from instrumentation import setup_logging, start_run, record_span
+from intervals import (
+    DAY_START, DAY_END, MIN_GAP, to_day, day_to_date, time_to_minutes,
+    events_to_intervals, events_by_date_from_intervals, free_periods_by_day, free_time_from_periods,
+)
+from slots import WORK_START, WORK_END, WORKDAYS, SlotIndexCache, parse_weekdays, slot_rows
+from team import expand_busy, merge_team_busy
+
+
+logger = logging.getLogger("schedulease.service")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+# Calendars known to this worker process, by id
+_worker_calendars = {}
+
+
+def worker_register(calendar_id, file_content):
+    _worker_calendars[calendar_id] = file_content
+
+
+def worker_forget(calendar_id):
+    _worker_calendars.pop(calendar_id, None)
+
+
+def worker_busy(calendar_id, first_day, last_day):
+    return expand_busy(_worker_calendars[calendar_id], day_to_date(first_day), day_to_date(last_day + 1))
+
+
+def worker_events(calendar_id, first_day, last_day):
+    events = calendar_cache.get_occurrences(_worker_calendars[calendar_id], day_to_date(first_day), day_to_date(last_day + 1))
+    return events_by_date_from_intervals(events_to_intervals(events))
+
+
+class AvailabilityService:
+    """Calendars, worker processes and the shared free time cache of one server.
+
+    Uploaded calendars are kept up to max_bytes in total, least recently
+    used first out.
+    """
+
+    def __init__(self, workers=None, max_bytes=512 * 1024 * 1024, max_body=64 * 1024 * 1024):
+        context = multiprocessing.get_context("spawn")
+        # One single-process pool per shard, so a calendar always meets its own cache
+        self.shards = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(workers or os.cpu_count())]
+        # Threads wait for the shards while the event loop keeps serving
+        self.threads = ThreadPoolExecutor(max_workers=4 * len(self.shards))
+        self.calendars = OrderedDict()
+        self.calendars_lock = threading.Lock()
+        self.total_bytes = 0
+        self.max_bytes = max_bytes
+        self.max_body = max_body
+        self.free_time_cache = FreeTimeCache()
+        self.slot_index_cache = SlotIndexCache()
+        self.routes = {
+            ("POST", "/calendars"): self.upload,
+            ("GET", "/events"): self.events,
+            ("GET", "/free-time"): self.free_time,
+            ("GET", "/slots"): self.slots,
+            ("GET", "/health"): self.health,
+        }
+
+    def shard(self, calendar_id):
+        return self.shards[int(calendar_id[:8], 16) % len(self.shards)]
+
+    def close(self):
+        self.threads.shutdown(wait=False)
+        for shard in self.shards:
+            shard.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, function, calendar_id, *args):
+        """Start function in the worker of calendar_id and return its future."""
+        with self.calendars_lock:
+            if calendar_id not in self.calendars:
+                raise KeyError(f"Unknown calendar {calendar_id}, upload it to /calendars first")
+            self.calendars.move_to_end(calendar_id)
+        return self.shard(calendar_id).submit(function, calendar_id, *args)
+
+    def result(self, future, function, calendar_id, *args):
+        """Wait for future; if the worker lost the calendar (e.g. it was restarted), register it again and retry."""
+        try:
+            return future.result()
+        except KeyError:
+            with self.calendars_lock:
+                file_content = self.calendars.get(calendar_id)
+            if file_content is None:
+                raise KeyError(f"Unknown calendar {calendar_id}, upload it to /calendars first")
+            self.shard(calendar_id).submit(worker_register, calendar_id, file_content).result()
+            return self.submit(function, calendar_id, *args).result()
+
+    def run_on_shard(self, function, calendar_id, *args):
+        return self.result(self.submit(function, calendar_id, *args), function, calendar_id, *args)
+
+    async def in_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.threads, function, *args)
+
+    # Endpoints
+
+    async def upload(self, params, body):
+        if body.find(b"BEGIN:VCALENDAR") < 0:
+            raise ValueError("The body is not an iCalendar file")
+        calendar_id = calendar_cache.fingerprint(body)
+        with self.calendars_lock:
+            known = calendar_id in self.calendars
+        if not known:
+            await asyncio.wrap_future(self.shard(calendar_id).submit(worker_register, calendar_id, body))
+            with self.calendars_lock:
+                if calendar_id not in self.calendars:
+                    self.calendars[calendar_id] = body
+                    self.total_bytes += len(body)
+                while len(self.calendars) > 1 and self.total_bytes > self.max_bytes:
+                    evicted, content = self.calendars.popitem(last=False)
+                    self.total_bytes -= len(content)
+                    self.shard(evicted).submit(worker_forget, evicted)
+        return {"calendar": calendar_id, "bytes": len(body)}
+
+    async def events(self, params, body):
+        calendar_id = one(params, "calendar")
+        first_day, last_day = day_range(params)
+        events_by_date = await self.in_thread(self.run_on_shard, worker_events, calendar_id, first_day, last_day)
+        return {"events": events_by_date}
+
+    def team_busy(self, calendar_ids, quorum, first_day, last_day):
+        """Merged busy Intervals of the calendars, each expanded in its own worker at the same time."""
+        futures = [self.submit(worker_busy, calendar_id, first_day, last_day) for calendar_id in calendar_ids]
+        return merge_team_busy([
+            self.result(future, worker_busy, calendar_id, first_day, last_day)
+            for calendar_id, future in zip(calendar_ids, futures)
+        ], quorum)
+
+    def team(self, params):
+        """(calendar_ids, quorum, fingerprint) of the calendars in params."""
+        calendar_ids = params.get("calendar") or []
+        if not calendar_ids:
+            raise ValueError("Missing parameter: calendar")
+        quorum = int(params["quorum"][0]) if "quorum" in params else len(calendar_ids)
+        # Every quorum in range gives its own key below; one calendar only has quorum 1
+        if not 1 <= quorum <= len(calendar_ids):
+            raise ValueError(f"quorum must be between 1 and {len(calendar_ids)}, the number of calendars")
+        fingerprint = calendar_ids[0] if len(calendar_ids) == 1 else team_fingerprint(calendar_ids, quorum)
+        return calendar_ids, quorum, fingerprint
+
+    def periods(self, params):
+        """(first_day, last_day, {day: periods}) of the calendars in params, answered from the shared cache."""
+        calendar_ids, quorum, fingerprint = self.team(params)
+        first_day, last_day = day_range(params)
+        rules = (
+            time_to_minutes(params["day_start"][0]) if "day_start" in params else DAY_START,
+            time_to_minutes(params["day_end"][0]) if "day_end" in params else DAY_END,
+            int(params["min_gap"][0]) if "min_gap" in params else MIN_GAP,
+        )
+
+        def compute(run_first, run_last):
+            busy = self.team_busy(calendar_ids, quorum, run_first, run_last)
+            return free_periods_by_day(run_first, run_last, busy, *rules)
+
+        return first_day, last_day, self.free_time_cache.free_periods(fingerprint, first_day, last_day, compute, *rules)
+
+    def slot_index(self, calendar_ids, quorum, fingerprint, first_day, last_day):
+        def load(index_first, index_last):
+            busy = self.team_busy(calendar_ids, quorum, index_first, index_last)
+            return [(interval.start, interval.end) for interval in busy]
+
+        return self.slot_index_cache.index(fingerprint, first_day, last_day, load)
+
+    async def free_time(self, params, body):
+        first_day, last_day, periods_by_day = await self.in_thread(self.periods, params)
+        return free_time_from_periods(first_day, last_day, periods_by_day)
+
+    async def slots(self, params, body):
+        calendar_ids, quorum, fingerprint = self.team(params)
+        first_day, last_day = day_range(params)
+        minutes = int(one(params, "minutes"))
+        # A warm index answers in well under a millisecond, right on the event loop
+        index = self.slot_index_cache.get(fingerprint, first_day, last_day)
+        if index is None:
+            index = await self.in_thread(self.slot_index, calendar_ids, quorum, fingerprint, first_day, last_day)
+        found = index.find_slots(
+            minutes,
+            int(params["count"][0]) if "count" in params else 1,
+            first_day,
+            last_day,
+            time_to_minutes(params["day_start"][0]) if "day_start" in params else WORK_START,
+            time_to_minutes(params["day_end"][0]) if "day_end" in params else WORK_END,
+            parse_weekdays(params["weekdays"][0]) if "weekdays" in params else WORKDAYS,
+            int(params["buffer"][0]) if "buffer" in params else 0,
+            int(params["align"][0]) if "align" in params else 15,
+        )
+        return {"slots": slot_rows(found)}
+
+    async def health(self, params, body):
+        return {
+            "status": "ok",
+            "calendars": len(self.calendars),
+            "bytes": self.total_bytes,
+            "workers": len(self.shards),
+            "free_time_cache": self.free_time_cache.info(),
+            "slot_index_cache": self.slot_index_cache.info(),
+        }
+
+    # HTTP
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                return 405, {"error": f"{method} is not allowed on {url.path}"}
+            return 404, {"error": f"No endpoint {url.path}"}
+
+        # Every request is a run of its own. Requests interleave on this
+        # thread, so the request is timed here instead of in a span left
+        # open across the await
+        start_run("http_request")
+        started = time.perf_counter()
+        try:
+            status, payload = 200, await handler(parse_qs(url.query), body)
+        except KeyError as e:
+            status, payload = 404, {"error": str(e.args[0]) if e.args else "Not found"}
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            logger.exception("Request %s %s failed", method, target)
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        record_span("http_request", time.perf_counter() - started, method=method, path=url.path, status=status)
+        return status, payload
+
+    async def handle_connection(self, reader, writer):
+        try:
+            # Keep-alive: serve requests on this connection until the client is done
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if length > self.max_body:
+                    status, payload = 413, {"error": f"Body larger than {self.max_body} bytes"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.dispatch(method, target, body)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # Client went away or sent something that is not HTTP
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=1024 * 1024)
+        print(f"Serving on http://{host}:{port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def one(params, name):
+    if name not in params:
+        raise ValueError(f"Missing parameter: {name}")
+    return params[name][0]
+
+
+def day_range(params):
+    first_day, last_day = to_day(one(params, "from")), to_day(one(params, "to"))
+    if first_day > last_day:
+        raise ValueError("'from' must be earlier than or equal to 'to'")
+    return first_day, last_day
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve calendar availability over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes for calendar expansion")
+    parser.add_argument("--max-megabytes", type=int, default=512, help="calendars kept in memory")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    service = AvailabilityService(args.workers, max_bytes=args.max_megabytes * 1024 * 1024)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Thin client of service.py, plus a small load test.
+
+Example:
+    python service_client.py --url http://localhost:8765 --calendar my.ics --requests 500 --concurrency 32
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+import argparse
+import hashlib
+import json
+import random
+import sys
+import time
+from intervals import DAY_START, DAY_END, MIN_GAP, minutes_to_time
+from slots import WORK_START, WORK_END, WORKDAYS
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class AvailabilityClient:
+    """Ask an availability service instead of parsing calendars in this process.
+
+    Calendars are uploaded once and then referred to by their SHA-256; if
+    the service has forgotten one (e.g. after a restart), it is uploaded
+    again and the request repeated.
+    """
+
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._uploaded = set()
+
+    def _request(self, path, params=None, body=None):
+        url = f"{self.url}{path}" + (f"?{urlencode(params, doseq=True)}" if params else "")
+        request = Request(url, data=body, method="POST" if body is not None else "GET")
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise ServiceError(e.code, message) from None
+
+    def upload(self, file_content):
+        calendar_id = hashlib.sha256(file_content).hexdigest()
+        if calendar_id not in self._uploaded:
+            self._request("/calendars", body=file_content)
+            self._uploaded.add(calendar_id)
+        return calendar_id
+
+    def _ask(self, path, file_contents, params):
+        params = dict(params, calendar=[self.upload(file_content) for file_content in file_contents])
+        try:
+            return self._request(path, params)
+        except ServiceError as e:
+            if e.status != 404:
+                raise
+            self._uploaded.clear()
+            params["calendar"] = [self.upload(file_content) for file_content in file_contents]
+            return self._request(path, params)
+
+    def events(self, file_content, from_date, to_date):
+        """Same shape as get_events_between_dates, for the days from_date to to_date (inclusive)."""
+        return self._ask("/events", [file_content], {"from": str(from_date), "to": str(to_date)})["events"]
+
+    def free_time(self, file_contents, from_date, to_date, quorum=None,
+                  day_start=DAY_START, day_end=DAY_END, min_gap=MIN_GAP):
+        """Same result as calculate_free_time for one calendar or a team."""
+        params = {
+            "from": str(from_date), "to": str(to_date),
+            "day_start": minutes_to_time(day_start), "day_end": minutes_to_time(day_end), "min_gap": min_gap,
+        }
+        if quorum is not None:
+            params["quorum"] = quorum
+        return self._ask("/free-time", file_contents, params)
+
+    def slots(self, file_contents, from_date, to_date, minutes, count=1, quorum=None,
+              day_start=WORK_START, day_end=WORK_END, weekdays=WORKDAYS, buffer=0, align=15):
+        """The count earliest slots of minutes minutes, as {"date", "start", "end"} dicts like slot_rows."""
+        params = {
+            "from": str(from_date), "to": str(to_date), "minutes": minutes, "count": count,
+            "day_start": minutes_to_time(day_start), "day_end": minutes_to_time(day_end),
+            "weekdays": ",".join(str(weekday) for weekday in weekdays), "buffer": buffer, "align": align,
+        }
+        if quorum is not None:
+            params["quorum"] = quorum
+        return self._ask("/slots", file_contents, params)["slots"]
+
+    def health(self):
+        return self._request("/health")
+
+
+def load_test(client, file_content, requests, concurrency, days, horizon, seed=0):
+    """Send requests free time queries of days days at random starts within horizon days."""
+    rng = random.Random(seed)
+    first = date.today()
+    windows = []
+    for _ in range(requests):
+        start = first + timedelta(days=rng.randrange(horizon))
+        windows.append((start, start + timedelta(days=days - 1)))
+    client.upload(file_content)
+
+    def one(window):
+        started = time.perf_counter()
+        client.free_time([file_content], *window)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = sorted(pool.map(one, windows))
+    elapsed = time.perf_counter() - started
+
+    def percentile(share):
+        return latencies[min(len(latencies) - 1, int(share * len(latencies)))] * 1000
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(0.5), 2),
+        "p95_ms": round(percentile(0.95), 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running availability service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--calendar", required=True, help=".ics file to query")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--days", type=int, default=30, help="days per free time query")
+    parser.add_argument("--horizon", type=int, default=365, help="days the query windows start in")
+    args = parser.parse_args(argv)
+
+    with open(args.calendar, "rb") as file:
+        file_content = file.read()
+    client = AvailabilityClient(args.url)
+    print(json.dumps(load_test(client, file_content, args.requests, args.concurrency, args.days, args.horizon)))
+    print(json.dumps(client.health()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
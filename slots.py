@@ -0,0 +1,179 @@
+from bisect import bisect_right
+from collections import OrderedDict
+import threading
+from intervals import MINUTES_PER_DAY, day_to_str, minutes_to_time, merge_intervals
+
+
+# Default booking rules: weekdays from 09.00 to 17.00
+WORK_START = 9 * 60
+WORK_END = 17 * 60
+WORKDAYS = (0, 1, 2, 3, 4)
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Day 0 (1970-01-01) was a Thursday
+EPOCH_WEEKDAY = 3
+
+# An index covers at least this many days, so repeated queries for the
+# next days or weeks keep hitting the same index
+MIN_INDEX_DAYS = 28
+
+
+def parse_weekdays(text):
+    """Read weekdays like "mon,tue,fri", "0,1,4" or "mon-fri" as a tuple of numbers (Monday is 0)."""
+    weekdays = set()
+    for part in text.lower().split(","):
+        bounds = [value.strip() for value in part.split("-")]
+        numbers = []
+        for value in bounds:
+            if value.isdigit() and int(value) < 7:
+                numbers.append(int(value))
+            elif value[:3] in WEEKDAY_NAMES:
+                numbers.append(WEEKDAY_NAMES.index(value[:3]))
+            else:
+                raise ValueError(f"Unknown weekday {value!r}")
+        weekdays.update(range(numbers[0], numbers[-1] + 1))
+    return tuple(sorted(weekdays))
+
+
+def slot_rows(slots):
+    """(start, end) slots in minutes since 1970 as {"date", "start", "end"} dicts."""
+    rows = []
+    for start, end in slots:
+        day = start // MINUTES_PER_DAY
+        base = day * MINUTES_PER_DAY
+        rows.append({"date": day_to_str(day), "start": minutes_to_time(start - base), "end": minutes_to_time(end - base)})
+    return rows
+
+
+class BusyIndex:
+    """Disjoint busy periods of a calendar (or a team) sorted by start, in minutes since 1970.
+
+    The index covers the days first_day to last_day; find_slots walks it
+    from a bisection point and stops as soon as enough slots are found, so
+    a query costs about the busy periods it passes, not the whole range.
+    """
+
+    __slots__ = ("starts", "ends", "first_day", "last_day")
+
+    def __init__(self, busy, first_day, last_day):
+        # busy is sorted, merged (start, end) pairs, e.g. from team.expand_busy
+        self.starts = [start for start, _ in busy]
+        self.ends = [end for _, end in busy]
+        self.first_day = first_day
+        self.last_day = last_day
+
+    @classmethod
+    def from_intervals(cls, intervals, first_day, last_day):
+        return cls([(start, end) for start, end in merge_intervals(intervals) if end > start], first_day, last_day)
+
+    def covers(self, first_day, last_day):
+        return self.first_day <= first_day and last_day <= self.last_day
+
+    def find_slots(self, duration, count=1, first_day=None, last_day=None, day_start=WORK_START, day_end=WORK_END,
+                   weekdays=WORKDAYS, buffer=0, align=15):
+        """Return the count earliest (start, end) slots of duration minutes.
+
+        Slots lie within day_start and day_end (minutes of the day) on the
+        given weekdays (Monday is 0), keep buffer minutes away from every
+        busy period and start on multiples of align minutes. A long free
+        period holds several consecutive slots.
+        """
+        if duration <= 0 or count <= 0:
+            raise ValueError("Duration and count must be positive")
+        if day_end <= day_start:
+            raise ValueError("Working hours must end after they start")
+        first_day = self.first_day if first_day is None else max(first_day, self.first_day)
+        last_day = self.last_day if last_day is None else min(last_day, self.last_day)
+        weekdays = frozenset(weekdays)
+        align = max(1, align)
+
+        starts, ends = self.starts, self.ends
+        slots = []
+        # First busy period whose end (plus buffer) reaches into the first day
+        position = bisect_right(ends, first_day * MINUTES_PER_DAY + day_start - buffer)
+
+        for day in range(first_day, last_day + 1):
+            if (day + EPOCH_WEEKDAY) % 7 not in weekdays:
+                continue
+            day_base = day * MINUTES_PER_DAY
+            window_start = day_base + day_start
+            window_end = day_base + day_end
+
+            while position < len(starts) and ends[position] + buffer <= window_start:
+                position += 1
+
+            cursor = window_start
+            scan = position
+            while cursor < window_end:
+                blocked = scan < len(starts) and starts[scan] - buffer < window_end
+                gap_end = starts[scan] - buffer if blocked else window_end
+
+                start = cursor + (-(cursor - day_base) % align)
+                while start + duration <= gap_end:
+                    slots.append((start, start + duration))
+                    if len(slots) == count:
+                        return slots
+                    start += duration
+                    start += -(start - day_base) % align
+
+                if not blocked:
+                    break
+                cursor = max(cursor, ends[scan] + buffer)
+                scan += 1
+        return slots
+
+
+class SlotIndexCache:
+    """BusyIndex per calendar key, least recently used first out.
+
+    index() widens the days an index covers when a query reaches past them;
+    load(first_day, last_day) must return the merged busy pairs of those days.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, first_day, last_day):
+        """The index of key if it covers the days first_day to last_day, else None."""
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None or not index.covers(first_day, last_day):
+                return None
+            self._indexes.move_to_end(key)
+            self.stats["hits"] += 1
+            return index
+
+    def index(self, key, first_day, last_day, load):
+        index = self.get(key, first_day, last_day)
+        if index is not None:
+            return index
+        with self._lock:
+            self.stats["misses"] += 1
+            index = self._indexes.get(key)
+
+        last_day = max(last_day, first_day + MIN_INDEX_DAYS - 1)
+        if index is not None:
+            first_day, last_day = min(first_day, index.first_day), max(last_day, index.last_day)
+        index = BusyIndex(load(first_day, last_day), first_day, last_day)
+
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+                self.stats["evictions"] += 1
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, indexes=len(self._indexes))
+
+
+slot_index_cache = SlotIndexCache()
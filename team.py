@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import multiprocessing
+import os
+import threading
+from calendar_cache import calendar_cache
+from intervals import Interval, events_to_intervals, merge_intervals
+
+
+_shards = None
+_shards_lock = threading.Lock()
+
+
+def get_shards():
+    """Single-process pools, one per CPU, created on first use.
+
+    A calendar is always expanded by the same shard (see shard_for), so the
+    calendar_cache of that worker keeps its parsed calendar and expanded
+    windows for the next request. Workers are spawned rather than forked
+    because Streamlit runs scripts in threads, and forking a threaded
+    process is unsafe.
+    """
+    global _shards
+    with _shards_lock:
+        if _shards is None:
+            context = multiprocessing.get_context("spawn")
+            _shards = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(os.cpu_count() or 1)]
+        return _shards
+
+
+def shard_for(fingerprint, shards):
+    return shards[int(fingerprint[:8], 16) % len(shards)]
+
+
+def expand_busy(file_content, start_date, end_date):
+    """Busy periods of one calendar as merged, sorted (start, end) minute pairs."""
+    events = calendar_cache.get_occurrences(file_content, start_date, end_date)
+    # All-day events are zero-length and block nothing
+    return [(start, end) for start, end in merge_intervals(events_to_intervals(events)) if end > start]
+
+
+def expand_calendars(file_contents, start_date, end_date):
+    """Expand many calendars in parallel, each on the shard of its fingerprint;
+    a single calendar is expanded in this process."""
+    if len(file_contents) <= 1:
+        return [expand_busy(file_content, start_date, end_date) for file_content in file_contents]
+    shards = get_shards()
+    futures = [
+        shard_for(calendar_cache.fingerprint(file_content), shards).submit(expand_busy, file_content, start_date, end_date)
+        for file_content in file_contents
+    ]
+    return [future.result() for future in futures]
+
+
+def merge_team_busy(busy_lists, quorum=None):
+    """Combine per-person busy periods into the periods that are not free enough.
+
+    busy_lists holds one list of merged, sorted (start, end) pairs per person.
+    A moment counts as free when at least quorum people are free (all of them
+    by default). The lists are combined with a k-way heap merge of their
+    boundaries, and the result is a sorted list of Interval, ready for
+    calculate_free_time.
+    """
+    people = len(busy_lists)
+    quorum = people if quorum is None else quorum
+    if people == 0 or quorum <= 0:
+        return []
+    if quorum > people:
+        raise ValueError(f"Quorum of {quorum} is larger than the {people} calendars given")
+
+    # A moment is blocked once more than this many people are busy
+    max_busy = people - quorum
+
+    def boundaries(busy):
+        for start, end in busy:
+            # Ends sort before starts at the same minute so touching periods do not overlap
+            yield start, 1
+            yield end, -1
+
+    blocked = []
+    busy_count = 0
+    blocked_start = None
+    for minute, change in heapq.merge(*(boundaries(busy) for busy in busy_lists), key=lambda item: (item[0], item[1])):
+        busy_count += change
+        if blocked_start is None and busy_count > max_busy:
+            blocked_start = minute
+        elif blocked_start is not None and busy_count <= max_busy:
+            if minute > blocked_start:
+                blocked.append(Interval(blocked_start, minute))
+            blocked_start = None
+    return blocked
+
+
+def get_team_busy_intervals(file_contents, start_date, end_date, quorum=None):
+    return merge_team_busy(expand_calendars(file_contents, start_date, end_date), quorum)
@@ -0,0 +1,79 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import pytest
+
+# The modules live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA = os.path.join(ROOT, "tests", "data")
+
+
+@pytest.fixture
+def sample_ics():
+    with open(os.path.join(DATA, "sample.ics"), "rb") as file:
+        return file.read()
+
+
+class StubOpenAI(BaseHTTPRequestHandler):
+    """Chat completions endpoint that answers "echo <last message>".
+
+    A message containing "fail" gets a 400, stream=True is answered as
+    server-sent events with a final usage chunk. Requests are recorded on
+    the server.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        text = body["messages"][-1]["content"]
+        if "fail" in text:
+            self.send_json(400, {"error": {"message": "rejected by the stub", "type": "invalid_request_error"}})
+            return
+
+        answer = f"echo {text}"
+        usage = {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}
+        if not body.get("stream"):
+            self.send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+        for piece in (answer[:4], answer[4:]):
+            event = dict(chunk, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(f"data: {json.dumps(dict(chunk, choices=[], usage=usage))}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+@pytest.fixture
+def openai_stub():
+    """Base URL of a local stub of the OpenAI API; .requests lists what it received."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAI)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}/v1"
+    yield server
+    server.shutdown()
+    server.server_close()
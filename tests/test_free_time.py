@@ -0,0 +1,113 @@
+from datetime import date
+import json
+import os
+import random
+import threading
+import pytest
+from calendar_cache import CalendarCache
+from calendar_store import CalendarStore
+from conftest import DATA
+from intervals import Interval, MINUTES_PER_DAY, to_day, day_to_date, calculate_free_time, calculate_free_time_vectorized
+from main import get_events_between_dates
+
+
+FROM, TO = date(2025, 1, 4), date(2025, 1, 31)
+
+
+def test_calculate_free_time_matches_baseline_output(sample_ics):
+    # Recorded with the original get_events_between_dates and calculate_free_time
+    with open(os.path.join(DATA, "sample_free_time.json")) as file:
+        baseline = json.load(file)
+
+    result = calculate_free_time(FROM, TO, get_events_between_dates(FROM, date(2025, 2, 1), sample_ics))
+
+    assert result["FreeTime"] == baseline["FreeTime"]
+    assert [list(day) for day in result["FreeTimeDays"]] == baseline["FreeTimeDays"]
+    assert result["TotalFreeTime"] == pytest.approx(baseline["TotalFreeTime"])
+
+
+def random_intervals(rng, first_day, last_day):
+    intervals = []
+    minute = first_day * MINUTES_PER_DAY - 120
+    while minute < (last_day + 1) * MINUTES_PER_DAY:
+        minute += rng.randrange(0, 300)
+        length = rng.choice([0, 10, 30, 45, 60, 240, 1600])
+        intervals.append(Interval(minute, minute + length, "busy"))
+        # Overlaps on purpose now and then
+        minute += length if rng.random() < 0.8 else length // 2
+    return intervals
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_vectorized_matches_scalar(seed):
+    rng = random.Random(seed)
+    first_day = to_day(date(2025, 1, 1)) + rng.randrange(30)
+    last_day = first_day + rng.randrange(10)
+    intervals = random_intervals(rng, first_day, last_day)
+    rules = rng.choice([(0, 23 * 60 + 59, 30), (8 * 60, 18 * 60, 0), (9 * 60, 17 * 60, 60)])
+    from_date, to_date = day_to_date(first_day), day_to_date(last_day)
+
+    scalar = calculate_free_time(from_date, to_date, intervals, *rules)
+    vectorized = calculate_free_time_vectorized(from_date, to_date, intervals, *rules)
+
+    assert vectorized["FreeTime"] == scalar["FreeTime"]
+    assert vectorized["FreeTimeDays"] == scalar["FreeTimeDays"]
+    assert vectorized["TotalFreeTime"] == pytest.approx(scalar["TotalFreeTime"])
+
+
+def test_events_without_uid_starting_together_are_kept(sample_ics):
+    events = CalendarCache().get_occurrences(sample_ics, date(2025, 1, 13), date(2025, 1, 14))
+    summaries = [str(event["SUMMARY"]) for event in events]
+    assert "Call A" in summaries and "Call B" in summaries
+
+
+def occurrences(events):
+    return sorted((str(event["SUMMARY"]), event["DTSTART"].dt) for event in events)
+
+
+@pytest.mark.parametrize("stream_threshold", [10 ** 9, 10])
+def test_cache_expands_windows_like_one_pass(sample_ics, stream_threshold):
+    cache = CalendarCache(stream_threshold=stream_threshold)
+    one_pass = occurrences(CalendarCache(stream_threshold=stream_threshold).get_occurrences(sample_ics, FROM, date(2025, 2, 1)))
+
+    # Overlapping and separate windows, then the whole range from the index
+    for start, end in [(date(2025, 1, 9), date(2025, 1, 12)), (date(2025, 1, 4), date(2025, 1, 10)), (date(2025, 1, 20), date(2025, 2, 1))]:
+        cache.get_occurrences(sample_ics, start, end)
+    assert occurrences(cache.get_occurrences(sample_ics, FROM, date(2025, 2, 1))) == one_pass
+
+
+def test_store_matches_calculate_free_time(sample_ics):
+    store = CalendarStore(":memory:")
+    expected = calculate_free_time(FROM, TO, get_events_between_dates(FROM, date(2025, 2, 1), sample_ics))
+
+    store.sync("owner/sample.ics", sample_ics)
+    assert store.free_time("owner/sample.ics", FROM, TO) == expected
+
+    # Moving the lecture changes only the days it touches
+    changed = sample_ics.replace(b"DTSTART:20250107T130000", b"DTSTART:20250107T140000")
+    report = store.sync("owner/sample.ics", changed)
+    assert report["changed"] == 1 and report["unchanged"] > 0
+    assert store.free_time("owner/sample.ics", FROM, TO) == calculate_free_time(
+        FROM, TO, get_events_between_dates(FROM, date(2025, 2, 1), changed)
+    )
+
+
+def test_store_sync_of_one_name_does_not_wait_for_another(sample_ics):
+    store = CalendarStore(":memory:")
+    first_day, last_day = to_day(FROM), to_day(TO)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with store._name_lock("owner/a.ics"):
+            held.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(10)
+    try:
+        periods = store.sync_and_free_periods("owner/b.ics", sample_ics, first_day, last_day)
+        assert len(periods) == last_day - first_day + 1
+    finally:
+        release.set()
+        thread.join()
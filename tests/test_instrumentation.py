@@ -0,0 +1,24 @@
+import instrumentation
+from instrumentation import collected_spans, record_span, span, start_run
+
+
+def test_spans_are_nested_and_collected_per_run():
+    start_run()
+    with span("outer"):
+        with span("inner") as record:
+            record["events"] = 3
+    spans = collected_spans()
+    assert [(record["span"], record["depth"]) for record in spans] == [("inner", 1), ("outer", 0)]
+    assert spans[0]["events"] == 3 and spans[0]["run"] == spans[1]["run"]
+
+    start_run()
+    assert collected_spans() == []
+
+
+def test_spans_of_a_long_run_are_bounded():
+    start_run()
+    for number in range(instrumentation.MAX_SPANS + 10):
+        record_span("step", 0.001, number=number)
+    spans = collected_spans()
+    assert len(spans) == instrumentation.MAX_SPANS
+    assert spans[-1]["number"] == instrumentation.MAX_SPANS + 9
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+import openai
+import pytest
+from instrumentation import collected_spans, start_run
+from llm_cache import CompletionCache, cached_completion
+from llm_client import complete_many, get_client, stream_completion
+
+
+MESSAGES = [{"role": "user", "content": "plan my week"}]
+
+class FakeClient:
+    """Just enough of OpenAI for cached_completion; counts the requests."""
+
+    def __init__(self, content="an answer"):
+        self.calls = 0
+        self.content = content
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"{self.content} {self.calls}"))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5),
+        )
+
+@pytest.fixture
+def cache(tmp_path):
+    return CompletionCache(str(tmp_path / "completions.sqlite3"))
+
+def test_cached_completion_asks_once(cache):
+    client = FakeClient()
+    first = cached_completion(client, "gpt-4o", MESSAGES, cache=cache)
+    second = cached_completion(client, "gpt-4o", MESSAGES, cache=cache)
+
+    assert first == second == "an answer 1"
+    assert client.calls == 1
+    assert cache.stats["hits"] == 1 and cache.stats["writes"] == 1
+
+def test_cached_completion_bypass_and_temperature(cache):
+    client = FakeClient()
+    cached_completion(client, "gpt-4o", MESSAGES, cache=cache)
+
+    # A bypassed request is sent again and replaces the stored answer
+    assert cached_completion(client, "gpt-4o", MESSAGES, bypass_cache=True, cache=cache) == "an answer 2"
+    assert cached_completion(client, "gpt-4o", MESSAGES, cache=cache) == "an answer 2"
+
+    # Sampled answers are never stored
+    cached_completion(client, "gpt-4o", MESSAGES, temperature=0.7, cache=cache)
+    cached_completion(client, "gpt-4o", MESSAGES, temperature=0.7, cache=cache)
+    assert client.calls == 4
+
+def test_cache_expires_and_evicts(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite3"), ttl_seconds=-1)
+    key = cache.make_key("gpt-4o", MESSAGES, 0)
+    cache.put(key, "gpt-4o", "old")
+    assert cache.get(key) is None and cache.stats["expired"] == 1
+
+    cache = CompletionCache(str(tmp_path / "small.sqlite3"), max_entries=2)
+    for number in range(3):
+        cache.put(cache.make_key("gpt-4o", [{"role": "user", "content": str(number)}], 0), "gpt-4o", "answer")
+    assert cache.info()["entries"] == 2
+
+
+
+def test_bypassed_requests_are_counted(cache):
+    client = FakeClient()
+    for _ in range(3):
+        cached_completion(client, "gpt-4o", MESSAGES, bypass_cache=True, cache=cache)
+    assert cache.info()["bypassed"] == 3 and client.calls == 3
+
+
+def test_complete_many_against_stub(openai_stub, cache):
+    messages_list = [[{"role": "user", "content": text}] for text in ("a", "b", "c")]
+
+    assert complete_many("key", messages_list, base_url=openai_stub.url, cache=cache) == ["echo a", "echo b", "echo c"]
+    assert complete_many("key", messages_list, base_url=openai_stub.url, cache=cache) == ["echo a", "echo b", "echo c"]
+    assert len(openai_stub.requests) == 3
+
+
+def test_complete_many_failures(openai_stub, cache):
+    messages_list = [[{"role": "user", "content": text}] for text in ("a", "fail")]
+
+    with pytest.raises(openai.BadRequestError):
+        complete_many("key", messages_list, base_url=openai_stub.url, cache=cache)
+
+    answers = complete_many("key", messages_list, base_url=openai_stub.url, cache=cache, return_exceptions=True)
+    assert answers[0] == "echo a"
+    assert isinstance(answers[1], openai.BadRequestError)
+
+
+def test_stream_completion_against_stub(openai_stub, cache):
+    client = get_client("key", base_url=openai_stub.url)
+
+    pieces = list(stream_completion(client, "gpt-4o", MESSAGES, cache=cache))
+    assert "".join(pieces) == "echo plan my week" and len(pieces) == 2
+
+    # The finished stream is cached and answered in one piece
+    assert list(stream_completion(client, "gpt-4o", MESSAGES, cache=cache)) == ["echo plan my week"]
+    assert len(openai_stub.requests) == 1
+
+
+def test_complete_many_logs_a_span_per_completion(openai_stub, cache):
+    start_run()
+    messages_list = [[{"role": "user", "content": text}] for text in ("a", "b", "c")]
+    complete_many("key", messages_list, base_url=openai_stub.url, cache=cache)
+    complete_many("key", messages_list, base_url=openai_stub.url, cache=cache)
+
+    completions = [record for record in collected_spans() if record["span"] == "openai_completion"]
+    assert len(completions) == 6
+    assert sum(record["cached"] for record in completions) == 3
+    assert all(record["prompt_tokens"] == 3 for record in completions if not record["cached"])
@@ -0,0 +1,105 @@
+from datetime import date
+import random
+import pytest
+from planner import (
+    allocate_schedule, create_ics, decode_compact_schedule, encode_free_times, iter_ics, parse_schedule_text, plan_tasks,
+)
+from schedule_check import repair_schedule, schedule_blocks, validate_schedule
+
+
+START, DEADLINE = date(2025, 1, 6), date(2025, 1, 11)
+FREE_TIMES = {
+    "06.01.2025": ["09.00-12.00", "14.00-18.00"],
+    "07.01.2025": ["08.00-10.00"],
+    "08.01.2025": [],
+    "09.01.2025": ["13.00-17.30"],
+    "10.01.2025": ["09.00-11.00", "15.00-16.00"],
+}
+
+
+def test_allocated_schedule_is_valid():
+    schedule = allocate_schedule("write report", START, DEADLINE, 8, FREE_TIMES, max_block_hours=2, min_break_minutes=30)
+    assert validate_schedule(schedule, FREE_TIMES, START, DEADLINE, 8) == []
+
+
+def test_compact_encoding_round_trip():
+    text = encode_free_times(FREE_TIMES, START)
+    assert text.splitlines()[0] == "+0: 0900-1200 1400-1800"
+    assert "+2:" not in text
+
+    decoded = decode_compact_schedule(text, START, "task")
+    assert decoded == {
+        date_str: [f"{period} task" for period in periods]
+        for date_str, periods in FREE_TIMES.items() if periods
+    }
+
+
+def test_repair_fixes_every_kind_of_issue():
+    broken = {
+        "05.01.2025": ["09.00-10.00 write report"],
+        "06.01.2025": ["11.00-13.00 write report", "11.30-12.00 write report"],
+        "07.01.2025": ["08.00-08.00 write report"],
+    }
+    kinds = {issue["kind"] for issue in validate_schedule(broken, FREE_TIMES, START, DEADLINE, 6)}
+    assert kinds == {"range", "busy", "overlap", "empty", "workload"}
+
+    repaired, fixes = repair_schedule(broken, FREE_TIMES, START, DEADLINE, 6, "write report")
+    assert fixes
+    assert validate_schedule(repaired, FREE_TIMES, START, DEADLINE, 6) == []
+
+
+def test_unreadable_dates_are_issues_not_errors():
+    polished = parse_schedule_text('"31.02.2025": ["09.00-11.00 write report"], "06.01.2025": ["09.00-11.00 write report"]')
+    issues = validate_schedule(polished, FREE_TIMES, START, DEADLINE, 2)
+    assert [(issue["kind"], issue["date"]) for issue in issues] == [("empty", "31.02.2025")]
+
+    repaired, fixes = repair_schedule(polished, FREE_TIMES, START, DEADLINE, 2, "write report")
+    assert "Removed 31.02.2025 09.00-11.00 write report" in fixes
+    assert validate_schedule(repaired, FREE_TIMES, START, DEADLINE, 2) == []
+
+
+def test_ics_export_keeps_task_names_with_quotes():
+    schedule = {"06.01.2025": ['09.00-11.00 Bob\'s "big" task for ACME']}
+    data = create_ics(schedule, tzid="Europe/Berlin")
+    assert b"".join(iter_ics(schedule, tzid="Europe/Berlin")).count(b"BEGIN:VEVENT") == 1
+    assert b"DTSTART;TZID=Europe/Berlin:20250106T090000" in data
+    assert b'SUMMARY:Bob\'s "big" task for ACME' in data
+
+
+def test_ics_export_gives_repeated_blocks_their_own_uid():
+    schedule = {"06.01.2025": ["09.00-10.00 review", "09.00-10.00 review", "11.00-12.00 review"]}
+    uids = [line for line in create_ics(schedule).splitlines() if line.startswith(b"UID:")]
+    assert len(uids) == len(set(uids)) == 3
+
+
+def task_blocks(schedule):
+    """{task: [(start, end)]} in minutes since 1970 from a plan_tasks schedule."""
+    blocks = {}
+    for start, end, _, slot in schedule_blocks(schedule):
+        blocks.setdefault(slot.split(" ", 1)[1], []).append((start, end))
+    return blocks
+
+
+def test_plan_tasks_repair_keeps_blocks_and_breaks():
+    free = {"06.01.2025": ["09.00-17.00"]}
+    schedule, report = plan_tasks([{"task": "A", "workload": 7, "start": START, "deadline": date(2025, 1, 7)}], free)
+    assert schedule["06.01.2025"] == ["09.00-11.00 A", "11.30-13.30 A", "14.00-16.00 A", "16.30-17.00 A"]
+    assert not report[0]["feasible"] and report[0]["missing_hours"] == 0.5
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_plan_tasks_never_breaks_the_rules(seed):
+    rng = random.Random(seed)
+    tasks = [
+        {"task": f"task {number}", "workload": rng.choice([1, 2.5, 4, 7]), "start": START,
+         "deadline": date(2025, 1, rng.randrange(7, 12)), "priority": rng.randrange(3)}
+        for number in range(rng.randrange(1, 5))
+    ]
+    schedule, report = plan_tasks(tasks, FREE_TIMES, max_block_hours=2, min_break_minutes=30)
+
+    for blocks in task_blocks(schedule).values():
+        for (start, end), (next_start, _) in zip(blocks, blocks[1:] + [(None, None)]):
+            assert end - start <= 120
+            assert next_start is None or next_start - end >= 30
+    for task, task_report in zip(tasks, report):
+        assert task_report["feasible"] == (task_report["allocated_hours"] >= task["workload"])
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from instrumentation import collected_spans
+from service import AvailabilityService
+
+
+@pytest.fixture
+def service():
+    service = AvailabilityService(workers=1)
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize("quorum", ["0", "3"])
+def test_service_rejects_quorum_out_of_range(service, quorum):
+    with pytest.raises(ValueError):
+        service.team({"calendar": ["a" * 64, "b" * 64], "quorum": [quorum]})
+    assert service.team({"calendar": ["a" * 64], "quorum": ["1"]})[1] == 1
+
+
+def test_requests_do_not_pile_up_spans(service):
+    async def requests():
+        for _ in range(50):
+            status, _ = await service.dispatch("GET", "/health", b"")
+            assert status == 200
+
+    asyncio.run(requests())
+    spans = collected_spans()
+    assert [record["span"] for record in spans] == ["http_request"]
+    assert spans[0]["status"] == 200 and spans[0]["path"] == "/health"
@@ -0,0 +1,71 @@
+import random
+import pytest
+from intervals import MINUTES_PER_DAY
+from slots import EPOCH_WEEKDAY, BusyIndex, SlotIndexCache, parse_weekdays
+
+
+def brute_force_slots(busy, first_day, last_day, duration, count, day_start, day_end, weekdays, buffer, align):
+    """Minute by minute reference of BusyIndex.find_slots."""
+    blocked = set()
+    for start, end in busy:
+        blocked.update(range(start - buffer, end + buffer))
+    slots = []
+    for day in range(first_day, last_day + 1):
+        if (day + EPOCH_WEEKDAY) % 7 not in weekdays:
+            continue
+        base = day * MINUTES_PER_DAY
+        minute = base + day_start
+        while minute + duration <= base + day_end:
+            if (minute - base) % align == 0 and blocked.isdisjoint(range(minute, minute + duration)):
+                slots.append((minute, minute + duration))
+                if len(slots) == count:
+                    return slots
+                minute += duration
+            else:
+                minute += 1
+    return slots
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_find_slots_matches_brute_force(seed):
+    rng = random.Random(seed)
+    first_day = 20000 + rng.randrange(7)
+    last_day = first_day + rng.randrange(6)
+    busy = []
+    minute = (first_day - 1) * MINUTES_PER_DAY
+    while minute < (last_day + 2) * MINUTES_PER_DAY:
+        minute += rng.randrange(10, 400)
+        length = rng.choice([15, 30, 60, 90, 200])
+        busy.append((minute, minute + length))
+        minute += length
+
+    query = (
+        rng.choice([15, 30, 45, 60, 120]), rng.randrange(1, 12), rng.choice([0, 420, 540]), rng.choice([720, 1020, 1439]),
+        set(rng.sample(range(7), rng.randrange(1, 8))), rng.choice([0, 5, 15]), rng.choice([1, 5, 15, 30]),
+    )
+    index = BusyIndex(busy, first_day - 1, last_day + 1)
+    assert index.find_slots(query[0], query[1], first_day, last_day, *query[2:]) == brute_force_slots(busy, first_day, last_day, *query)
+
+
+def test_parse_weekdays():
+    assert parse_weekdays("mon-fri") == (0, 1, 2, 3, 4)
+    assert parse_weekdays("sat,0") == (0, 5)
+    assert parse_weekdays("Tuesday") == (1,)
+    with pytest.raises(ValueError):
+        parse_weekdays("someday")
+
+
+def test_index_cache_widens_instead_of_reloading_every_day():
+    loads = []
+
+    def load(first_day, last_day):
+        loads.append((first_day, last_day))
+        return []
+
+    cache = SlotIndexCache()
+    cache.index("calendar", 100, 101, load)
+    cache.index("calendar", 110, 120, load)
+    cache.index("calendar", 90, 95, load)
+    assert loads == [(100, 127), (90, 127)]
+    assert cache.get("calendar", 95, 127) is not None
+
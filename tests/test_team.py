@@ -0,0 +1,24 @@
+from datetime import date
+from calendar_cache import calendar_cache
+from team import expand_busy, get_shards, get_team_busy_intervals, merge_team_busy, shard_for
+
+
+def pairs(intervals):
+    return [(interval.start, interval.end) for interval in intervals]
+
+
+def test_team_busy_matches_one_process(sample_ics):
+    moved = sample_ics.replace(b"DTSTART:20250107T130000", b"DTSTART:20250107T140000")
+    start, end = date(2025, 1, 4), date(2025, 2, 1)
+    local = pairs(merge_team_busy([expand_busy(content, start, end) for content in (sample_ics, moved)], quorum=1))
+
+    assert local
+    assert pairs(get_team_busy_intervals([sample_ics, moved], start, end, quorum=1)) == local
+    # Asked again, every calendar goes to the worker that has it cached
+    assert pairs(get_team_busy_intervals([moved, sample_ics], start, end, quorum=1)) == local
+
+
+def test_a_calendar_always_meets_the_same_shard(sample_ics):
+    shards = get_shards()
+    fingerprint = calendar_cache.fingerprint(sample_ics)
+    assert shard_for(fingerprint, shards) is shard_for(fingerprint, get_shards())